@@ -3,15 +3,93 @@ Database models and operations for InSightMail
 """
 import sqlite3
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator, Set
 from enum import Enum
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean
+from contextlib import contextmanager, closing
+from sqlalchemy import create_engine, event, func, text, tuple_, column, Column, Integer, String, DateTime, Text, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker, defer, Session
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = [
+    "journal_mode=WAL",       # readers don't block the writer
+    "synchronous=NORMAL",     # fsync at checkpoints only; safe with WAL
+    "temp_store=MEMORY",
+    "mmap_size=268435456",    # 256 MB memory-mapped reads
+    "cache_size=-65536",      # 64 MB page cache
+    "analysis_limit=1000",    # bounded, sampled ANALYZE
+]
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune SQLite on connect"""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+# Full-text index over emails (external content table kept in sync by triggers)
+EMAILS_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+        subject, snippet, sender, body,
+        content='emails', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS emails_fts_ai AFTER INSERT ON emails BEGIN
+        INSERT INTO emails_fts(rowid, subject, snippet, sender, body)
+        VALUES (new.id, new.subject, new.snippet, new.sender, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS emails_fts_ad AFTER DELETE ON emails BEGIN
+        INSERT INTO emails_fts(emails_fts, rowid, subject, snippet, sender, body)
+        VALUES ('delete', old.id, old.subject, old.snippet, old.sender, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS emails_fts_au AFTER UPDATE OF subject, snippet, sender, body ON emails BEGIN
+        INSERT INTO emails_fts(emails_fts, rowid, subject, snippet, sender, body)
+        VALUES ('delete', old.id, old.subject, old.snippet, old.sender, old.body);
+        INSERT INTO emails_fts(rowid, subject, snippet, sender, body)
+        VALUES (new.id, new.subject, new.snippet, new.sender, new.body);
+    END""",
+]
+EMAILS_FTS_BACKFILL = "INSERT INTO emails_fts(emails_fts) VALUES ('rebuild')"
+
+# Per-category email counts maintained by triggers, so pipeline stats never scan emails
+CATEGORY_COUNTS_DDL = [
+    """CREATE TABLE IF NOT EXISTS category_counts (
+        category TEXT PRIMARY KEY,
+        n INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS category_counts_ai AFTER INSERT ON emails
+    WHEN new.category IS NOT NULL BEGIN
+        INSERT INTO category_counts(category, n) VALUES (new.category, 1)
+        ON CONFLICT(category) DO UPDATE SET n = n + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS category_counts_ad AFTER DELETE ON emails
+    WHEN old.category IS NOT NULL BEGIN
+        UPDATE category_counts SET n = n - 1 WHERE category = old.category;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS category_counts_au AFTER UPDATE OF category ON emails
+    WHEN old.category IS NOT new.category BEGIN
+        UPDATE category_counts SET n = n - 1 WHERE category = old.category;
+        INSERT INTO category_counts(category, n) SELECT new.category, 1 WHERE new.category IS NOT NULL
+        ON CONFLICT(category) DO UPDATE SET n = n + 1;
+    END""",
+]
+CATEGORY_COUNTS_BACKFILL = """INSERT INTO category_counts(category, n)
+    SELECT category, COUNT(*) FROM emails WHERE category IS NOT NULL GROUP BY category"""
+
+# Hot query shapes that must be served by an index (checked by check_query_plans)
+HOT_QUERIES = {
+    "email_by_gmail_id": "SELECT * FROM emails WHERE gmail_id = 'x'",
+    "emails_by_account": "SELECT * FROM emails WHERE account_email = 'x' ORDER BY date_received DESC",
+    "emails_by_category": "SELECT * FROM emails WHERE category = 'x' ORDER BY date_received DESC",
+    "recent_emails": "SELECT * FROM emails WHERE date_received >= '2000-01-01' ORDER BY date_received DESC",
+    "unprocessed_emails": "SELECT * FROM emails WHERE is_processed = 0",
+}
+
 class EmailCategory(Enum):
     APPLICATION_SENT = "Application Sent"
     RECRUITER_RESPONSE = "Recruiter Response"
@@ -39,6 +117,14 @@ class Email(Base):
     embedding_id = Column(String)  # Reference to Chroma vector store
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        # Composite indexes for filtered lists ordered by date
+        Index("ix_emails_account_date", "account_email", "date_received"),
+        Index("ix_emails_category_date", "category", "date_received"),
+        # Partial index for the unprocessed work queue
+        Index("ix_emails_unprocessed", "is_processed", sqlite_where=is_processed == False),
+    )
 
 class JobApplication(Base):
     __tablename__ = "job_applications"
@@ -58,12 +144,63 @@ class DatabaseManager:
     def __init__(self, db_path: str = "data/insightmail.db"):
         self.db_path = db_path
         self.engine = create_engine(f"sqlite:///{db_path}")
+        event.listen(self.engine, "connect", _set_sqlite_pragmas)
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.fts_enabled = False
+        self.category_counts_enabled = False
         self.create_tables()
+        
+        if os.getenv("CHECK_QUERY_PLANS", "false").lower() == "true":
+            self.check_query_plans()
     
     def create_tables(self):
         """Create all tables"""
         Base.metadata.create_all(bind=self.engine)
+        
+        # create_all skips existing tables, so add any indexes introduced later
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=self.engine, checkfirst=True)
+        
+        self.fts_enabled = self._create_trigger_table("emails_fts", EMAILS_FTS_DDL, EMAILS_FTS_BACKFILL)
+        if not self.fts_enabled:
+            logger.warning("FTS5 unavailable, falling back to LIKE search")
+        
+        self.category_counts_enabled = self._create_trigger_table(
+            "category_counts", CATEGORY_COUNTS_DDL, CATEGORY_COUNTS_BACKFILL
+        )
+    
+    def _create_trigger_table(self, name: str, ddl: List[str], backfill: str) -> bool:
+        """Create a trigger-maintained table, backfilling it on first creation"""
+        try:
+            with self.engine.begin() as conn:
+                exists = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+                ).first()
+                for statement in ddl:
+                    conn.exec_driver_sql(statement)
+                if not exists:
+                    conn.exec_driver_sql(backfill)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to create {name}: {e}")
+            return False
+    
+    def check_query_plans(self) -> Dict[str, List[str]]:
+        """Run EXPLAIN QUERY PLAN on hot queries; return those that scan the table or sort"""
+        problems = {}
+        
+        # Fresh connection: pooled ones cache prepared EXPLAIN output across schema changes
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            for name, sql in HOT_QUERIES.items():
+                details = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+                # Every hot query filters, so any SCAN (even over an index) is a full pass
+                bad = [detail for detail in details if detail.startswith("SCAN") or "TEMP B-TREE" in detail]
+                if bad:
+                    problems[name] = details
+                    logger.warning(f"Query plan regression for {name}: {details}")
+        
+        return problems
     
     def get_db(self) -> Session:
         """Get database session"""
@@ -73,43 +210,151 @@ class DatabaseManager:
         finally:
             db.close()
     
-    def add_email(self, email_data: Dict[str, Any]) -> Email:
-        """Add a new email to the database"""
+    @contextmanager
+    def session_scope(self, session: Optional[Session] = None) -> Iterator[Session]:
+        """
+        Use the caller's session, or open a short-lived one.
+        
+        Every DatabaseManager method accepts an optional ``session``. For batched
+        work, open one session and pass it to each call so the batch shares a
+        single connection and transaction; the caller then commits once.
+        """
+        if session is not None:
+            yield session
+            return
+        
         with self.SessionLocal() as db:
+            yield db
+    
+    def _commit(self, db: Session, session: Optional[Session]):
+        """Commit a session we own; only flush one the caller owns"""
+        if session is None:
+            db.commit()
+        else:
+            db.flush()
+    
+    def add_email(self, email_data: Dict[str, Any], session: Optional[Session] = None) -> Email:
+        """Add a new email to the database"""
+        with self.session_scope(session) as db:
             email = Email(**email_data)
             db.add(email)
-            db.commit()
+            self._commit(db, session)
             db.refresh(email)
             return email
     
-    def get_email_by_gmail_id(self, gmail_id: str) -> Optional[Email]:
+    def add_emails_bulk(self, email_dicts: List[Dict[str, Any]], chunk_size: int = 10000,
+                        session: Optional[Session] = None) -> int:
+        """
+        Insert many emails in one transaction per chunk
+        Statistics are refreshed here only when we own the session; a caller passing
+        its own session calls update_statistics() after committing
+        """
+        columns = set(Email.__table__.columns.keys())
+        rows = [{k: v for k, v in data.items() if k in columns} for data in email_dicts]
+        
+        with self.session_scope(session) as db:
+            for i in range(0, len(rows), chunk_size):
+                db.bulk_insert_mappings(Email, rows[i:i + chunk_size])
+                self._commit(db, session)
+        
+        if rows and session is None:
+            self.update_statistics()
+        
+        return len(rows)
+    
+    def update_statistics(self, session: Optional[Session] = None):
+        """Refresh planner statistics (sqlite_stat tables) after large data changes"""
+        with self.session_scope(session) as db:
+            db.execute(text("ANALYZE"))
+            self._commit(db, session)
+    
+    def get_email_by_gmail_id(self, gmail_id: str, session: Optional[Session] = None) -> Optional[Email]:
         """Get email by Gmail ID"""
-        with self.SessionLocal() as db:
+        with self.session_scope(session) as db:
             return db.query(Email).filter(Email.gmail_id == gmail_id).first()
     
-    def get_emails_by_account(self, account_email: str) -> List[Email]:
+    def existing_gmail_ids(self, gmail_ids: List[str], chunk_size: int = 500,
+                           session: Optional[Session] = None) -> Set[str]:
+        """Return which of the given Gmail IDs are already stored"""
+        ids = list(dict.fromkeys(gmail_id for gmail_id in gmail_ids if gmail_id))
+        found = set()
+        
+        # Chunked to stay under SQLite's bound-parameter limit
+        with self.session_scope(session) as db:
+            for i in range(0, len(ids), chunk_size):
+                rows = db.query(Email.gmail_id).filter(Email.gmail_id.in_(ids[i:i + chunk_size])).all()
+                found.update(row[0] for row in rows)
+        
+        return found
+    
+    def get_email_ids(self, gmail_ids: List[str], chunk_size: int = 500,
+                      session: Optional[Session] = None) -> Dict[str, int]:
+        """Map the given Gmail IDs to their stored row ids (e.g. after add_emails_bulk)"""
+        ids = list(dict.fromkeys(gmail_id for gmail_id in gmail_ids if gmail_id))
+        found = {}
+        
+        with self.session_scope(session) as db:
+            for i in range(0, len(ids), chunk_size):
+                rows = db.query(Email.gmail_id, Email.id).filter(Email.gmail_id.in_(ids[i:i + chunk_size])).all()
+                found.update((gmail_id, email_id) for gmail_id, email_id in rows)
+        
+        return found
+    
+    def get_emails_by_gmail_ids(self, gmail_ids: List[str], chunk_size: int = 500,
+                                session: Optional[Session] = None) -> Dict[str, Email]:
+        """Load stored emails (without bodies) for the given Gmail IDs, keyed by Gmail ID"""
+        ids = list(dict.fromkeys(gmail_id for gmail_id in gmail_ids if gmail_id))
+        found = {}
+        
+        with self.session_scope(session) as db:
+            for i in range(0, len(ids), chunk_size):
+                rows = db.query(Email).options(defer(Email.body)).filter(Email.gmail_id.in_(ids[i:i + chunk_size])).all()
+                found.update((email.gmail_id, email) for email in rows)
+        
+        return found
+    
+    def get_email_body(self, email_id: int, session: Optional[Session] = None) -> Optional[str]:
+        """Get the full body of one email (list queries defer it)"""
+        with self.session_scope(session) as db:
+            row = db.query(Email.body).filter(Email.id == email_id).first()
+            return row[0] if row else None
+    
+    def get_emails_by_account(self, account_email: str, session: Optional[Session] = None) -> List[Email]:
         """Get all emails for a specific Gmail account"""
-        with self.SessionLocal() as db:
-            return db.query(Email).filter(Email.account_email == account_email).all()
+        return list(self.iter_emails_by_account(account_email, session=session))
+    
+    def iter_emails_by_account(self, account_email: str, batch_size: int = 1000,
+                               session: Optional[Session] = None) -> Iterator[Email]:
+        """Stream emails for a Gmail account in batches instead of loading them all"""
+        with self.session_scope(session) as db:
+            yield from db.query(Email).options(defer(Email.body)).filter(
+                Email.account_email == account_email
+            ).execution_options(stream_results=True).yield_per(batch_size)
     
-    def get_emails_by_category(self, category: EmailCategory) -> List[Email]:
+    def get_emails_by_category(self, category: EmailCategory, session: Optional[Session] = None) -> List[Email]:
         """Get emails by job category"""
-        with self.SessionLocal() as db:
-            return db.query(Email).filter(Email.category == category.value).all()
+        with self.session_scope(session) as db:
+            return db.query(Email).options(defer(Email.body)).filter(Email.category == category.value).all()
     
-    def get_recent_emails(self, days: int = 30) -> List[Email]:
+    def get_recent_emails(self, days: int = 30, session: Optional[Session] = None) -> List[Email]:
         """Get emails from the last N days"""
+        return list(self.iter_recent_emails(days, session=session))
+    
+    def iter_recent_emails(self, days: int = 30, batch_size: int = 1000,
+                           session: Optional[Session] = None) -> Iterator[Email]:
+        """Stream emails from the last N days, newest first"""
         from datetime import timedelta
         cutoff_date = datetime.utcnow() - timedelta(days=days)
         
-        with self.SessionLocal() as db:
-            return db.query(Email).filter(
+        with self.session_scope(session) as db:
+            yield from db.query(Email).options(defer(Email.body)).filter(
                 Email.date_received >= cutoff_date
-            ).order_by(Email.date_received.desc()).all()
+            ).order_by(Email.date_received.desc()).execution_options(stream_results=True).yield_per(batch_size)
     
-    def update_email_classification(self, email_id: int, category: str, summary: str, confidence: float):
+    def update_email_classification(self, email_id: int, category: str, summary: str, confidence: float,
+                                    session: Optional[Session] = None):
         """Update email classification results"""
-        with self.SessionLocal() as db:
+        with self.session_scope(session) as db:
             email = db.query(Email).filter(Email.id == email_id).first()
             if email:
                 email.category = category
@@ -117,39 +362,81 @@ class DatabaseManager:
                 email.confidence_score = str(confidence)
                 email.is_processed = True
                 email.updated_at = datetime.utcnow()
-                db.commit()
+                self._commit(db, session)
     
-    def get_job_pipeline_stats(self) -> Dict[str, int]:
+    def get_job_pipeline_stats(self, session: Optional[Session] = None) -> Dict[str, int]:
         """Get statistics for job application pipeline"""
-        with self.SessionLocal() as db:
-            stats = {}
-            for category in EmailCategory:
-                count = db.query(Email).filter(Email.category == category.value).count()
-                stats[category.value] = count
-            return stats
+        with self.session_scope(session) as db:
+            if self.category_counts_enabled:
+                rows = db.execute(text("SELECT category, n FROM category_counts")).all()
+            else:
+                rows = db.query(Email.category, func.count(Email.id)).group_by(Email.category).all()
+        
+        stats = {category.value: 0 for category in EmailCategory}
+        for category, count in rows:
+            if category in stats:
+                stats[category] = count
+        return stats
     
-    def add_job_application(self, app_data: Dict[str, Any]) -> JobApplication:
+    def add_job_application(self, app_data: Dict[str, Any], session: Optional[Session] = None) -> JobApplication:
         """Add a new job application"""
-        with self.SessionLocal() as db:
+        with self.session_scope(session) as db:
             application = JobApplication(**app_data)
             db.add(application)
-            db.commit()
+            self._commit(db, session)
             db.refresh(application)
             return application
     
-    def get_all_applications(self) -> List[JobApplication]:
-        """Get all job applications"""
-        with self.SessionLocal() as db:
-            return db.query(JobApplication).order_by(JobApplication.application_date.desc()).all()
+    def get_all_applications(self, session: Optional[Session] = None) -> List[JobApplication]:
+        """Get all job applications (notes deferred)"""
+        with self.session_scope(session) as db:
+            return db.query(JobApplication).options(defer(JobApplication.notes)).order_by(
+                JobApplication.application_date.desc()
+            ).all()
     
-    def search_emails(self, query: str, limit: int = 50) -> List[Email]:
-        """Search emails by content"""
-        with self.SessionLocal() as db:
-            return db.query(Email).filter(
-                (Email.subject.contains(query)) |
-                (Email.snippet.contains(query)) |
-                (Email.sender.contains(query))
-            ).order_by(Email.date_received.desc()).limit(limit).all()
+    def search_emails(self, query: str, limit: int = 50, before: Optional[datetime] = None,
+                      before_id: Optional[int] = None, session: Optional[Session] = None) -> List[Email]:
+        """
+        Search emails by content, newest first
+        Pass the last row's date_received/id as before/before_id to fetch the next page
+        """
+        match = self._fts_match_query(query)
+        
+        with self.session_scope(session) as db:
+            if self.fts_enabled and match:
+                fts_ids = text(
+                    "SELECT rowid FROM emails_fts WHERE emails_fts MATCH :match"
+                ).bindparams(match=match).columns(column("rowid", Integer))
+                search_filter = Email.id.in_(fts_ids)
+            else:
+                search_filter = (
+                    (Email.subject.contains(query)) |
+                    (Email.snippet.contains(query)) |
+                    (Email.sender.contains(query))
+                )
+            
+            results = db.query(Email).options(defer(Email.body)).filter(search_filter)
+            return self.keyset_page(results, before, before_id).limit(limit).all()
+    
+    @staticmethod
+    def keyset_page(query, before: Optional[datetime] = None, before_id: Optional[int] = None):
+        """
+        Order an Email query newest first and start it after a (date_received, id) cursor
+        Unlike OFFSET, skipped rows are never read, so deep pages cost the same as the first
+        """
+        if before is not None:
+            if before_id is None:
+                query = query.filter(Email.date_received < before)
+            else:
+                query = query.filter(tuple_(Email.date_received, Email.id) < (before, before_id))
+        
+        return query.order_by(Email.date_received.desc(), Email.id.desc())
+    
+    @staticmethod
+    def _fts_match_query(query: str) -> str:
+        """Build an FTS5 MATCH expression: every term as a quoted prefix"""
+        terms = [term.replace('"', '""') for term in (query or "").split()]
+        return " ".join(f'"{term}"*' for term in terms)
 
 # Global database instance
 db_manager = DatabaseManager()
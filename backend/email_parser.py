@@ -4,23 +4,73 @@ Email parsing utilities for Gmail exports and API data
 import json
 import email
 import base64
+import hashlib
 import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Iterable, BinaryIO
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.header import decode_header
 import logging
 
+try:
+    import ijson
+except ImportError:  # Optional streaming JSON parser; fall back to json.load
+    ijson = None
+
+try:
+    import xxhash
+except ImportError:  # Optional fast hash; fall back to hashlib.blake2b
+    xxhash = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # Optional C HTML parser; fall back to regex stripping
+    LexborHTMLParser = None
+
 from .utils import (
     extract_sender_info, 
     extract_company_from_email, 
     parse_gmail_date,
     clean_email_content,
     extract_email_metadata,
+    JOB_KEYWORDS_PATTERN,
     logger
 )
 
+# Precompiled HTML stripping patterns (fallback when selectolax is not installed)
+HTML_SCRIPT_STYLE_PATTERN = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+def decode_base64_text(data: str) -> str:
+    """Decode Gmail's URL-safe base64 body data to text, padding only as needed"""
+    padding = -len(data) % 4
+    if padding:
+        data += '=' * padding
+    return base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+
+def stable_content_id(content: str) -> str:
+    """Deterministic content hash (unlike hash(), stable across processes)"""
+    data = content.encode('utf-8', errors='ignore')
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# Below this many files, process pool startup costs more than it saves
+PARALLEL_PARSE_MIN_FILES = 4
+
+def html_to_text(html_content: str) -> str:
+    """Convert HTML to plain text, dropping script and style content"""
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html_content)
+        tree.strip_tags(['script', 'style'])
+        return tree.text(separator=' ')
+    
+    html_content = HTML_SCRIPT_STYLE_PATTERN.sub('', html_content)
+    return HTML_TAG_PATTERN.sub('', html_content)
+
 class EmailParser:
     """Parse emails from various sources (Gmail API, exports, EML files)"""
     
@@ -52,14 +102,7 @@ class EmailParser:
                 logger.error("Unsupported JSON format")
                 return emails
             
-            for message in messages:
-                try:
-                    parsed_email = self._parse_gmail_message(message, account_email)
-                    if parsed_email:
-                        emails.append(parsed_email)
-                except Exception as e:
-                    logger.warning(f"Failed to parse message {message.get('id', 'unknown')}: {e}")
-                    continue
+            emails = self._parse_gmail_messages(messages, account_email)
             
             logger.info(f"Successfully parsed {len(emails)} emails from JSON")
             return emails
@@ -68,6 +111,50 @@ class EmailParser:
             logger.error(f"Failed to parse Gmail JSON: {e}")
             return emails
     
+    def parse_gmail_json_stream(self, file_path: str, account_email: str) -> List[Dict[str, Any]]:
+        """
+        Stream-parse a Gmail JSON export file one message at a time
+        Memory stays bounded by a single message instead of the whole export
+        """
+        with open(file_path, 'rb') as f:
+            return self.parse_gmail_json_file(f, account_email)
+    
+    def parse_gmail_json_file(self, f: BinaryIO, account_email: str) -> List[Dict[str, Any]]:
+        """Stream-parse Gmail JSON from a seekable binary file object (e.g. an upload)"""
+        if ijson is None:
+            return self.parse_gmail_json(json.load(f), account_email)
+        
+        # A top-level array holds messages directly; otherwise expect {"messages": [...]}
+        start = f.tell()
+        head = f.read(1024).lstrip()
+        f.seek(start)
+        prefix = 'item' if head.startswith(b'[') else 'messages.item'
+        
+        emails = self._parse_gmail_messages(ijson.items(f, prefix, use_float=True), account_email)
+        
+        if not emails and prefix == 'messages.item':
+            # Single-message file: small enough to load whole
+            f.seek(start)
+            return self.parse_gmail_json(json.load(f), account_email)
+        
+        logger.info(f"Successfully parsed {len(emails)} emails from JSON")
+        return emails
+    
+    def _parse_gmail_messages(self, messages: Iterable[Dict[str, Any]], account_email: str) -> List[Dict[str, Any]]:
+        """Parse a sequence of Gmail messages, skipping ones that fail"""
+        emails = []
+        
+        for message in messages:
+            try:
+                parsed_email = self._parse_gmail_message(message, account_email)
+                if parsed_email:
+                    emails.append(parsed_email)
+            except Exception as e:
+                logger.warning(f"Failed to parse message {message.get('id', 'unknown')}: {e}")
+                continue
+        
+        return emails
+    
     def _parse_gmail_message(self, message: Dict[str, Any], account_email: str) -> Optional[Dict[str, Any]]:
         """Parse individual Gmail message"""
         try:
@@ -118,13 +205,29 @@ class EmailParser:
             if 'body' in payload and payload['body'].get('data'):
                 # Simple message
                 body_data = payload['body']['data']
-                decoded = base64.urlsafe_b64decode(body_data + '===').decode('utf-8', errors='ignore')
+                decoded = decode_base64_text(body_data)
                 body_parts.append(decoded)
             
             elif 'parts' in payload:
-                # Multipart message
-                for part in payload['parts']:
-                    body_parts.extend(self._extract_part_content(part))
+                # Multipart message: iterative depth-first walk, parts kept in order
+                stack = list(reversed(payload['parts']))
+                while stack:
+                    part = stack.pop()
+                    mime_type = part.get('mimeType', '')
+                    
+                    # Text content
+                    if mime_type.startswith('text/'):
+                        body_data = (part.get('body') or {}).get('data')
+                        if body_data:
+                            try:
+                                decoded = decode_base64_text(body_data)
+                                body_parts.append(decoded)
+                            except Exception as e:
+                                logger.warning(f"Failed to extract part content: {e}")
+                    
+                    # Nested parts
+                    elif 'parts' in part:
+                        stack.extend(reversed(part['parts']))
             
             return '\n'.join(body_parts)
             
@@ -132,30 +235,6 @@ class EmailParser:
             logger.warning(f"Failed to extract message body: {e}")
             return ""
     
-    def _extract_part_content(self, part: Dict[str, Any]) -> List[str]:
-        """Recursively extract content from message parts"""
-        content = []
-        
-        try:
-            mime_type = part.get('mimeType', '')
-            
-            # Text content
-            if mime_type.startswith('text/'):
-                if 'body' in part and part['body'].get('data'):
-                    body_data = part['body']['data']
-                    decoded = base64.urlsafe_b64decode(body_data + '===').decode('utf-8', errors='ignore')
-                    content.append(decoded)
-            
-            # Nested parts
-            elif 'parts' in part:
-                for subpart in part['parts']:
-                    content.extend(self._extract_part_content(subpart))
-            
-        except Exception as e:
-            logger.warning(f"Failed to extract part content: {e}")
-        
-        return content
-    
     def parse_eml_content(self, eml_content: str, account_email: str) -> List[Dict[str, Any]]:
         """Parse EML (email) file content"""
         emails = []
@@ -176,25 +255,28 @@ class EmailParser:
             if not date_received:
                 date_received = datetime.now()
             
-            # Extract body
-            body = self._extract_eml_body(msg)
-            snippet = body[:200] if body else ""
+            # Extract body; clean it once and take the snippet from the cleaned text
+            body = clean_email_content(self._extract_eml_body(msg))
+            snippet = body[:200]
+            
+            # Extract sender information
+            sender_info = extract_sender_info(sender)
             
             # Create email data
             email_data = {
-                'gmail_id': message_id or f"eml_{hash(eml_content)}",
+                'gmail_id': message_id or f"eml_{stable_content_id(eml_content)}",
                 'account_email': account_email,
                 'subject': subject,
                 'sender': sender,
                 'recipient': recipient,
-                'snippet': clean_email_content(snippet),
-                'body': clean_email_content(body),
+                'snippet': snippet,
+                'body': body,
                 'date_received': date_received,
                 'thread_id': '',
                 'labels': [],
-                'sender_name': extract_sender_info(sender)['name'],
-                'sender_email': extract_sender_info(sender)['email'],
-                'company': extract_company_from_email(extract_sender_info(sender)['email'])
+                'sender_name': sender_info['name'],
+                'sender_email': sender_info['email'],
+                'company': extract_company_from_email(sender_info['email'])
             }
             
             emails.append(email_data)
@@ -250,9 +332,7 @@ class EmailParser:
                         content = part.get_payload(decode=True)
                         if content:
                             html_content = content.decode(charset, errors='ignore')
-                            # Basic HTML to text conversion
-                            text_content = re.sub(r'<[^>]+>', '', html_content)
-                            body_parts.append(text_content)
+                            body_parts.append(html_to_text(html_content))
             else:
                 # Simple message
                 charset = msg.get_content_charset() or 'utf-8'
@@ -283,58 +363,67 @@ class EmailParser:
     
     def deduplicate_emails(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Remove duplicate emails based on gmail_id"""
-        seen_ids = set()
-        unique_emails = []
-        
+        # Dict keyed by gmail_id keeps the first occurrence and insertion order
+        unique = {}
         for email_data in emails:
             gmail_id = email_data.get('gmail_id')
-            if gmail_id and gmail_id not in seen_ids:
-                seen_ids.add(gmail_id)
-                unique_emails.append(email_data)
+            if gmail_id:
+                unique.setdefault(gmail_id, email_data)
+        unique_emails = list(unique.values())
         
         logger.info(f"Deduplicated {len(emails)} -> {len(unique_emails)} emails")
         return unique_emails
     
     def filter_job_related(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Pre-filter potentially job-related emails"""
-        from .utils import is_job_related_email
-        
-        job_emails = []
-        for email_data in emails:
-            if is_job_related_email(
-                email_data.get('subject', ''),
-                email_data.get('sender', ''),
-                email_data.get('snippet', '')
-            ):
-                job_emails.append(email_data)
+        search = JOB_KEYWORDS_PATTERN.search
+        job_emails = [
+            email_data for email_data in emails
+            if search(f"{email_data.get('subject', '')} {email_data.get('sender', '')} {email_data.get('snippet', '')}")
+        ]
         
         logger.info(f"Filtered {len(emails)} -> {len(job_emails)} job-related emails")
         return job_emails
     
-    def batch_parse_files(self, file_paths: List[str], account_email: str) -> List[Dict[str, Any]]:
-        """Parse multiple files"""
+    def parse_file(self, file_path: str, account_email: str) -> List[Dict[str, Any]]:
+        """Parse a single export file (JSON or EML)"""
+        try:
+            if file_path.endswith('.json'):
+                emails = self.parse_gmail_json_stream(file_path, account_email)
+            elif file_path.endswith('.eml'):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    emails = self.parse_eml_content(f.read(), account_email)
+            else:
+                logger.warning(f"Unsupported file format: {file_path}")
+                return []
+            
+            logger.info(f"Parsed {len(emails)} emails from {file_path}")
+            return emails
+        
+        except Exception as e:
+            logger.error(f"Failed to parse file {file_path}: {e}")
+            return []
+    
+    def batch_parse_files(self, 
+                          file_paths: List[str], 
+                          account_email: str,
+                          max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Parse multiple files, using worker processes for larger batches"""
         all_emails = []
         
-        for file_path in file_paths:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                if file_path.endswith('.json'):
-                    data = json.loads(content)
-                    emails = self.parse_gmail_json(data, account_email)
-                elif file_path.endswith('.eml'):
-                    emails = self.parse_eml_content(content, account_email)
-                else:
-                    logger.warning(f"Unsupported file format: {file_path}")
-                    continue
-                
-                all_emails.extend(emails)
-                logger.info(f"Parsed {len(emails)} emails from {file_path}")
-                
-            except Exception as e:
-                logger.error(f"Failed to parse file {file_path}: {e}")
+        if len(file_paths) < PARALLEL_PARSE_MIN_FILES:
+            for file_path in file_paths:
+                all_emails.extend(self.parse_file(file_path, account_email))
+        else:
+            # Parsing is CPU-bound pure Python, so spread files across processes
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for emails in executor.map(_parse_file_worker, file_paths, repeat(account_email), chunksize=4):
+                    all_emails.extend(emails)
         
         # Deduplicate across all files
         return self.deduplicate_emails(all_emails)
 
+def _parse_file_worker(file_path: str, account_email: str) -> List[Dict[str, Any]]:
+    """Process pool entry point for batch_parse_files"""
+    return EmailParser().parse_file(file_path, account_email)
+
@@ -2,14 +2,89 @@
 LLM adapter for Ollama integration - local model inference
 """
 import asyncio
-import json
+import os
+import importlib.util
 import httpx
-from typing import Dict, List, Any, Optional, Union
+import orjson
+from typing import Dict, List, Any, Optional, Union, AsyncIterator, Tuple
 import logging
 import time
+from contextlib import aclosing
+from functools import lru_cache
 from datetime import datetime
 
-from .utils import logger
+from .utils import LRUCache, cache_key, logger
+
+try:
+    import diskcache
+except ImportError:  # Optional persistent response cache; fall back to in-memory only
+    diskcache = None
+
+# Request bodies are pre-encoded with orjson and sent as raw content
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Seconds a fetched /api/tags model list is reused by health checks
+TAGS_CACHE_TTL = 10.0
+
+# Prompt templates are built once; callers fill them with str.format_map
+STRUCTURED_PROMPT_TEMPLATE = """
+{prompt}
+
+Please respond with a valid JSON object matching this schema:
+{schema}
+
+Response (JSON only):
+"""
+
+CLASSIFY_PROMPT_TEMPLATE = """
+Classify the following text into one of these categories: {categories}
+
+Text to classify:
+{text}
+
+{context}
+
+Respond with a JSON object containing:
+- "category": the most appropriate category from the list
+- "confidence": confidence score from 0.0 to 1.0
+- "reasoning": brief explanation of the classification
+"""
+
+CLASSIFY_SCHEMA = {
+    "category": "string (one of the provided categories)",
+    "confidence": "number (0.0 to 1.0)",
+    "reasoning": "string (brief explanation)"
+}
+
+SUMMARIZE_PROMPT_TEMPLATE = """
+Summarize the following text in {style} style, keeping it under {max_length} characters:
+
+Text:
+{text}
+
+Summary:
+"""
+
+EXTRACT_PROMPT_TEMPLATE = """
+Extract the following information from the text: {fields}
+
+Text:
+{text}
+
+Please respond with a JSON object where each field is a key, and the value is the extracted information (use null if not found).
+"""
+
+@lru_cache(maxsize=256)
+def _dump_schema_items(schema_items: tuple) -> str:
+    """Serialize a schema given as a tuple of items (hashable for lru_cache)"""
+    return orjson.dumps(dict(schema_items), option=orjson.OPT_INDENT_2).decode()
+
+def schema_to_json(schema: Dict[str, Any]) -> str:
+    """Pretty-print a schema for prompts, memoized for flat (hashable) schemas"""
+    try:
+        return _dump_schema_items(tuple(schema.items()))
+    except TypeError:  # Nested dict/list values are unhashable
+        return orjson.dumps(schema, option=orjson.OPT_INDENT_2).decode()
 
 class LLMAdapter:
     """Adapter for Ollama local LLM inference"""
@@ -17,13 +92,31 @@ class LLMAdapter:
     def __init__(self, 
                  base_url: str = "http://localhost:11434",
                  model_name: str = "mistral:7b",
-                 backup_model: str = "phi3:mini"):
+                 backup_model: str = "phi3:mini",
+                 cache_dir: Optional[str] = None):
         self.base_url = base_url
         self.model_name = model_name
         self.backup_model = backup_model
-        self.client = httpx.AsyncClient(timeout=300.0)  # 5 minute timeout
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(300.0, connect=10.0),  # 5 minute timeout for generation
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60),
+            http2=importlib.util.find_spec("h2") is not None  # Negotiated over TLS for remote Ollama
+        )
         self.available_models = []
         self.current_model = model_name
+        self.keep_alive = "30m"
+        
+        # /api/tags result shared by health checks and model listing
+        self._tags_cache: Optional[Tuple[float, List[str]]] = None
+        self._tags_lock = asyncio.Lock()
+        
+        # Adapter-wide admission control shared by every endpoint and batch job
+        self._gen_sem = asyncio.Semaphore(int(os.getenv("OLLAMA_MAX_INFLIGHT", "4")))
+        
+        # Structured responses keyed by model + prompt hash, so repeated emails skip the LLM
+        self.response_cache = LRUCache(maxsize=1024)
+        self.disk_cache = diskcache.Cache(cache_dir) if diskcache is not None and cache_dir else None
         
         # Model configurations
         self.model_configs = {
@@ -50,10 +143,8 @@ class LLMAdapter:
     async def health_check(self) -> str:
         """Check if Ollama is running and models are available"""
         try:
-            response = await self.client.get(f"{self.base_url}/api/tags")
-            if response.status_code == 200:
-                data = response.json()
-                models = [model['name'] for model in data.get('models', [])]
+            models = await self._get_tags()
+            if models is not None:
                 self.available_models = models
                 
                 # Check if preferred model is available
@@ -76,15 +167,32 @@ class LLMAdapter:
     async def list_models(self) -> List[str]:
         """List available models"""
         try:
-            response = await self.client.get(f"{self.base_url}/api/tags")
-            if response.status_code == 200:
-                data = response.json()
-                return [model['name'] for model in data.get('models', [])]
-            return []
+            return await self._get_tags() or []
         except Exception as e:
             logger.error(f"Failed to list models: {e}")
             return []
     
+    async def _get_tags(self) -> Optional[List[str]]:
+        """
+        Installed model names from /api/tags, cached for TAGS_CACHE_TTL seconds
+        Concurrent callers share one fetch; returns None if Ollama answers with an error
+        """
+        if self._tags_cache and time.monotonic() - self._tags_cache[0] < TAGS_CACHE_TTL:
+            return self._tags_cache[1]
+        
+        async with self._tags_lock:
+            # Another caller may have refreshed the cache while we waited
+            if self._tags_cache and time.monotonic() - self._tags_cache[0] < TAGS_CACHE_TTL:
+                return self._tags_cache[1]
+            
+            response = await self.client.get("/api/tags")
+            if response.status_code != 200:
+                return None
+            
+            models = [model['name'] for model in response.json().get('models', [])]
+            self._tags_cache = (time.monotonic(), models)
+            return models
+    
     async def pull_model(self, model_name: str) -> bool:
         """Pull a model if not available"""
         try:
@@ -92,13 +200,13 @@ class LLMAdapter:
             
             async with self.client.stream(
                 'POST',
-                f"{self.base_url}/api/pull",
+                "/api/pull",
                 json={"name": model_name}
             ) as response:
                 if response.status_code == 200:
                     async for line in response.aiter_lines():
                         if line:
-                            data = json.loads(line)
+                            data = orjson.loads(line)
                             if data.get('status'):
                                 logger.info(f"Pull status: {data['status']}")
                     return True
@@ -114,40 +222,27 @@ class LLMAdapter:
                               **kwargs) -> str:
         """Generate response from LLM"""
         try:
-            model_to_use = model or self.current_model
-            config = self.model_configs.get(model_to_use, self.model_configs["mistral:7b"])
-            
-            # Prepare request
-            request_data = {
-                "model": model_to_use,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": kwargs.get("temperature", config["temperature"]),
-                    "top_p": kwargs.get("top_p", config["top_p"]),
-                    "num_predict": kwargs.get("max_tokens", config["max_tokens"]),
-                    "stop": config["stop"]
-                }
-            }
-            
-            if system_prompt:
-                request_data["system"] = system_prompt
+            request_data = self._build_generate_request(prompt, system_prompt, model, stream=False, **kwargs)
             
             start_time = time.time()
             
-            response = await self.client.post(
-                f"{self.base_url}/api/generate",
-                json=request_data
-            )
+            async with self._gen_sem:
+                response = await self.client.post(
+                    "/api/generate",
+                    content=orjson.dumps(request_data),
+                    headers=JSON_HEADERS
+                )
             
             if response.status_code == 200:
-                data = response.json()
+                # orjson parses the raw UTF-8 bytes without an intermediate str
+                data = orjson.loads(await response.aread())
                 result = data.get('response', '').strip()
                 
-                # Log metrics
-                duration = time.time() - start_time
-                token_count = len(result.split())
-                logger.info(f"LLM response: {duration:.2f}s, ~{token_count} tokens")
+                # Log metrics (rough word count, without splitting the response)
+                if logger.isEnabledFor(logging.INFO):
+                    duration = time.time() - start_time
+                    token_count = result.count(' ') + 1
+                    logger.info(f"LLM response: {duration:.2f}s, ~{token_count} tokens")
                 
                 return result
             else:
@@ -158,87 +253,239 @@ class LLMAdapter:
             logger.error(f"LLM generation failed: {e}")
             return f"Error: {str(e)}"
     
+    async def generate_response_stream(self, 
+                                     prompt: str, 
+                                     system_prompt: Optional[str] = None,
+                                     model: Optional[str] = None,
+                                     **kwargs) -> AsyncIterator[str]:
+        """
+        Stream response chunks from LLM
+        Closing the generator early closes the HTTP response and stops generation
+        """
+        request_data = self._build_generate_request(prompt, system_prompt, model, stream=True, **kwargs)
+        
+        # Held for the whole stream: the model is busy until the response ends
+        async with self._gen_sem:
+            async with self.client.stream(
+                'POST',
+                "/api/generate",
+                content=orjson.dumps(request_data),
+                headers=JSON_HEADERS
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise httpx.HTTPStatusError(
+                        f"LLM request failed: {response.status_code} - {response.text}",
+                        request=response.request,
+                        response=response
+                    )
+                
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = orjson.loads(line)
+                    if data.get('response'):
+                        yield data['response']
+                    if data.get('done'):
+                        break
+    
+    def _build_generate_request(self, 
+                                prompt: str,
+                                system_prompt: Optional[str],
+                                model: Optional[str],
+                                stream: bool,
+                                **kwargs) -> Dict[str, Any]:
+        """Build the /api/generate request body"""
+        model_to_use = model or self.current_model
+        config = self.model_configs.get(model_to_use, self.model_configs["mistral:7b"])
+        
+        request_data = {
+            "model": model_to_use,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {
+                "temperature": kwargs.get("temperature", config["temperature"]),
+                "top_p": kwargs.get("top_p", config["top_p"]),
+                "num_predict": kwargs.get("max_tokens", config["max_tokens"]),
+                "num_ctx": config.get("num_ctx", 4096),
+                "stop": config["stop"]
+            },
+            # Keep the model resident between calls instead of reloading it
+            "keep_alive": kwargs.get("keep_alive", self.keep_alive)
+        }
+        
+        if system_prompt:
+            request_data["system"] = system_prompt
+        
+        # Constrained decoding: "json" or a JSON Schema dict
+        if kwargs.get("format"):
+            request_data["format"] = kwargs["format"]
+        
+        return request_data
+    
+    async def _generate_json_text(self, 
+                                  prompt: str,
+                                  system_prompt: Optional[str] = None,
+                                  model: Optional[str] = None,
+                                  **kwargs) -> str:
+        """Stream a response and stop as soon as the top-level JSON object closes"""
+        chunks = []
+        depth = 0
+        in_string = False
+        escaped = False
+        
+        async with aclosing(self.generate_response_stream(prompt, system_prompt, model, **kwargs)) as stream:
+            async for chunk in stream:
+                for i, char in enumerate(chunk):
+                    if in_string:
+                        if escaped:
+                            escaped = False
+                        elif char == '\\':
+                            escaped = True
+                        elif char == '"':
+                            in_string = False
+                    elif char == '"':
+                        in_string = True
+                    elif char == '{':
+                        depth += 1
+                    elif char == '}':
+                        depth -= 1
+                        if depth == 0:
+                            chunks.append(chunk[:i + 1])
+                            return "".join(chunks).strip()
+                chunks.append(chunk)
+        
+        return "".join(chunks).strip()
+    
     async def generate_structured_response(self, 
                                          prompt: str,
                                          schema: Dict[str, Any],
                                          system_prompt: Optional[str] = None,
-                                         model: Optional[str] = None) -> Dict[str, Any]:
+                                         model: Optional[str] = None,
+                                         **kwargs) -> Dict[str, Any]:
         """Generate structured JSON response"""
         try:
             # Add JSON formatting instruction to prompt
-            json_prompt = f"""
-{prompt}
-
-Please respond with a valid JSON object matching this schema:
-{json.dumps(schema, indent=2)}
-
-Response (JSON only):
-"""
+            json_prompt = STRUCTURED_PROMPT_TEMPLATE.format_map({
+                'prompt': prompt,
+                'schema': schema_to_json(schema)
+            })
+            kwargs.setdefault("temperature", 0.2)  # Lower temperature for structured output
             
-            response = await self.generate_response(
+            key = cache_key(
+                model or self.current_model,
+                system_prompt or "",
+                json_prompt,
+                repr(sorted(kwargs.items()))
+            )
+            cached = self._get_cached_response(key)
+            if cached is not None:
+                return cached
+            
+            # format="json" makes Ollama emit valid JSON, so no salvage parsing is needed;
+            # streaming lets us stop once the object closes instead of waiting on trailing tokens
+            response = await self._generate_json_text(
                 json_prompt, 
                 system_prompt=system_prompt,
                 model=model,
-                temperature=0.2  # Lower temperature for structured output
+                format="json",
+                **kwargs
             )
             
-            # Try to parse JSON
             try:
-                # Clean response - remove any text before/after JSON
-                json_start = response.find('{')
-                json_end = response.rfind('}') + 1
-                
-                if json_start >= 0 and json_end > json_start:
-                    json_str = response[json_start:json_end]
-                    return json.loads(json_str)
-                else:
-                    # Fallback: try to parse entire response
-                    return json.loads(response)
-                    
-            except json.JSONDecodeError as e:
-                logger.warning(f"Failed to parse JSON response: {e}")
-                logger.warning(f"Raw response: {response[:200]}...")
-                
-                # Return default structure
-                return {
-                    "error": "Failed to parse JSON",
-                    "raw_response": response[:500],
-                    "parsed": False
-                }
+                result = orjson.loads(response)
+            except orjson.JSONDecodeError:
+                # Single retry with the invalid output fed back to the model
+                retry_prompt = f"""{json_prompt}
+Your previous reply was not valid JSON:
+{response[:1000]}
+
+Response (JSON only):
+"""
+                response = await self._generate_json_text(
+                    retry_prompt,
+                    system_prompt=system_prompt,
+                    model=model,
+                    format="json",
+                    **kwargs
+                )
+                result = orjson.loads(response)
+            
+            self._set_cached_response(key, result)
+            return result
                 
+        except orjson.JSONDecodeError as e:
+            logger.warning(f"Failed to parse JSON response: {e}")
+            logger.warning(f"Raw response: {response[:200]}...")
+            
+            # Return default structure
+            return {
+                "error": "Failed to parse JSON",
+                "raw_response": response[:500],
+                "parsed": False
+            }
+        
         except Exception as e:
             logger.error(f"Structured generation failed: {e}")
             return {"error": str(e), "parsed": False}
     
+    async def batch_structured_response(self, 
+                                        prompts: List[str],
+                                        schema: Dict[str, Any],
+                                        max_concurrent: Optional[int] = None,
+                                        **kwargs) -> List[Dict[str, Any]]:
+        """
+        Structured responses for many prompts, returned in prompt order
+        Ollama has no batch generation endpoint, so identical prompts are sent once and the rest
+        run concurrently; the server batches them itself up to OLLAMA_NUM_PARALLEL
+        """
+        semaphore = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+        
+        async def process_single(prompt: str) -> Dict[str, Any]:
+            try:
+                if semaphore is None:
+                    return await self.generate_structured_response(prompt, schema, **kwargs)
+                async with semaphore:
+                    return await self.generate_structured_response(prompt, schema, **kwargs)
+            except Exception as e:
+                logger.error(f"Batch structured generation failed: {e}")
+                return {"error": str(e), "parsed": False}
+        
+        unique_prompts = list(dict.fromkeys(prompts))
+        results = await asyncio.gather(*(process_single(prompt) for prompt in unique_prompts))
+        by_prompt = dict(zip(unique_prompts, results))
+        
+        # Copies, so callers sharing a duplicate prompt can mutate their result independently
+        return [dict(by_prompt[prompt]) for prompt in prompts]
+    
+    def _get_cached_response(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a structured response in memory, then on disk"""
+        result = self.response_cache.get(key)
+        if result is None and self.disk_cache is not None:
+            result = self.disk_cache.get(key)
+            if result is not None:
+                self.response_cache.set(key, result)
+        return dict(result) if isinstance(result, dict) else result
+    
+    def _set_cached_response(self, key: str, result: Any):
+        """Store a successfully parsed structured response"""
+        self.response_cache.set(key, result)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, result)
+    
     async def classify_text(self, 
                           text: str, 
                           categories: List[str],
                           context: Optional[str] = None) -> Dict[str, Any]:
         """Classify text into predefined categories"""
         try:
-            categories_str = ", ".join(categories)
+            prompt = CLASSIFY_PROMPT_TEMPLATE.format_map({
+                'categories': ", ".join(categories),
+                'text': text,
+                'context': f"Additional context: {context}" if context else ""
+            })
             
-            prompt = f"""
-Classify the following text into one of these categories: {categories_str}
-
-Text to classify:
-{text}
-
-{f"Additional context: {context}" if context else ""}
-
-Respond with a JSON object containing:
-- "category": the most appropriate category from the list
-- "confidence": confidence score from 0.0 to 1.0
-- "reasoning": brief explanation of the classification
-"""
-            
-            schema = {
-                "category": "string (one of the provided categories)",
-                "confidence": "number (0.0 to 1.0)",
-                "reasoning": "string (brief explanation)"
-            }
-            
-            return await self.generate_structured_response(prompt, schema)
+            return await self.generate_structured_response(prompt, CLASSIFY_SCHEMA)
             
         except Exception as e:
             logger.error(f"Classification failed: {e}")
@@ -255,14 +502,11 @@ Respond with a JSON object containing:
                            style: str = "concise") -> str:
         """Summarize text"""
         try:
-            prompt = f"""
-Summarize the following text in {style} style, keeping it under {max_length} characters:
-
-Text:
-{text}
-
-Summary:
-"""
+            prompt = SUMMARIZE_PROMPT_TEMPLATE.format_map({
+                'style': style,
+                'max_length': max_length,
+                'text': text
+            })
             
             return await self.generate_response(
                 prompt,
@@ -278,16 +522,10 @@ Summary:
                                 fields: List[str]) -> Dict[str, Any]:
         """Extract specific information from text"""
         try:
-            fields_str = ", ".join(fields)
-            
-            prompt = f"""
-Extract the following information from the text: {fields_str}
-
-Text:
-{text}
-
-Please respond with a JSON object where each field is a key, and the value is the extracted information (use null if not found).
-"""
+            prompt = EXTRACT_PROMPT_TEMPLATE.format_map({
+                'fields': ", ".join(fields),
+                'text': text
+            })
             
             schema = {field: "string or null" for field in fields}
             
@@ -299,35 +537,53 @@ Please respond with a JSON object where each field is a key, and the value is th
     
     async def batch_process(self, 
                            prompts: List[str],
-                           max_concurrent: int = 3) -> List[str]:
-        """Process multiple prompts concurrently"""
-        semaphore = asyncio.Semaphore(max_concurrent)
-        
-        async def process_single(prompt: str) -> str:
-            async with semaphore:
-                return await self.generate_response(prompt)
+                           max_concurrent: Optional[int] = None) -> List[str]:
+        """
+        Process multiple prompts concurrently
+        Ollama concurrency is capped adapter-wide (OLLAMA_MAX_INFLIGHT); max_concurrent adds a tighter per-batch bound
+        """
+        processed_results = [None] * len(prompts)
         
-        tasks = [process_single(prompt) for prompt in prompts]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Handle exceptions
-        processed_results = []
-        for i, result in enumerate(results):
+        async for i, result in self.batch_process_stream(prompts, max_concurrent):
             if isinstance(result, Exception):
                 logger.error(f"Batch processing failed for prompt {i}: {result}")
-                processed_results.append(f"Error: {str(result)}")
+                processed_results[i] = f"Error: {str(result)}"
             else:
-                processed_results.append(result)
+                processed_results[i] = result
         
         return processed_results
     
+    async def batch_process_stream(self, 
+                                   prompts: List[str],
+                                   max_concurrent: Optional[int] = None) -> AsyncIterator[Tuple[int, Union[str, Exception]]]:
+        """Yield (index, response or exception) pairs as each prompt finishes"""
+        semaphore = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+        
+        async def process_single(i: int, prompt: str) -> Tuple[int, Union[str, Exception]]:
+            try:
+                if semaphore is None:
+                    return i, await self.generate_response(prompt)
+                async with semaphore:
+                    return i, await self.generate_response(prompt)
+            except Exception as e:
+                return i, e
+        
+        tasks = [asyncio.ensure_future(process_single(i, prompt)) for i, prompt in enumerate(prompts)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Consumer stopped early: don't leave requests running
+            for task in tasks:
+                task.cancel()
+    
     async def get_model_info(self, model_name: Optional[str] = None) -> Dict[str, Any]:
         """Get information about a model"""
         try:
             model_to_check = model_name or self.current_model
             
             response = await self.client.post(
-                f"{self.base_url}/api/show",
+                "/api/show",
                 json={"name": model_to_check}
             )
             
@@ -369,7 +625,5 @@ Please respond with a JSON object where each field is a key, and the value is th
     async def close(self):
         """Close HTTP client"""
         await self.client.aclose()
-
-# Global LLM adapter instance
-llm_adapter = LLMAdapter()
-
+        if self.disk_cache is not None:
+            self.disk_cache.close()
@@ -1,28 +1,48 @@
 """
 FastAPI main application for InSightMail
 """
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer, load_only
+from typing import List, Dict, Any, Optional, Tuple
+from contextlib import asynccontextmanager
 import os
-import json
+import asyncio
 import logging
 from datetime import datetime, timedelta
 
 from .db import DatabaseManager, db_manager, EmailCategory, Email
 from .email_parser import EmailParser
-from .rag_pipeline import RAGPipeline
+from .rag_pipeline import RAGPipeline, get_rag_pipeline
 from .llm_adapter import LLMAdapter
 from .summarizer_chain import SummarizerChain
 from .utils import logger
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the LLM client and summarizer on the running event loop, close them on shutdown"""
+    app.state.llm = LLMAdapter(cache_dir="data/llm_cache")
+    app.state.summarizer_chain = SummarizerChain(app.state.llm)
+    await app.state.llm.health_check()
+    if os.getenv("RAG_PRELOAD", "0") == "1":
+        # Load the embedding model before serving instead of on the first search
+        await asyncio.to_thread(get_rag_pipeline)
+    try:
+        yield
+    finally:
+        await app.state.llm.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="InSightMail API",
     description="LLM-powered email copilot for job hunting progress tracking",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -34,11 +54,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize components
+# Initialize components (the LLM client and summarizer live on app.state, see lifespan;
+# the RAG pipeline is created lazily by get_rag_pipeline)
 email_parser = EmailParser()
-rag_pipeline = RAGPipeline()
-llm_adapter = LLMAdapter()
-summarizer_chain = SummarizerChain(llm_adapter)
+
+def get_llm(request: Request) -> LLMAdapter:
+    """Dependency returning the app-wide LLM adapter"""
+    return request.app.state.llm
+
+def get_summarizer_chain(request: Request) -> SummarizerChain:
+    """Dependency returning the app-wide summarizer chain"""
+    return request.app.state.summarizer_chain
 
 # Pydantic models for API
 class EmailData(BaseModel):
@@ -63,13 +89,35 @@ class SummaryResponse(BaseModel):
     stats: Dict[str, int]
     recent_activity: List[Dict[str, Any]]
 
+class EmailOut(BaseModel, from_attributes=True):
+    """Email as returned by the API (body excluded)"""
+    id: int
+    gmail_id: Optional[str] = None
+    account_email: Optional[str] = None
+    subject: Optional[str] = None
+    sender: Optional[str] = None
+    recipient: Optional[str] = None
+    snippet: Optional[str] = None
+    date_received: Optional[datetime] = None
+    category: Optional[str] = None
+    summary: Optional[str] = None
+    confidence_score: Optional[str] = None
+    is_processed: Optional[bool] = None
+    created_at: Optional[datetime] = None
+
+# Serializes a whole page of ORM rows in one pass
+EmailOutList = TypeAdapter(List[EmailOut])
+
+# Email fields the dashboard's recent-activity list renders
+DASHBOARD_EMAIL_FIELDS = "subject,sender,category,date_received,confidence_score"
+
 @app.get("/")
 async def root():
     """Root endpoint"""
     return {"message": "InSightMail API is running"}
 
 @app.get("/health")
-async def health_check():
+async def health_check(llm_adapter: LLMAdapter = Depends(get_llm)):
     """Health check endpoint"""
     try:
         # Check database connection
@@ -92,27 +140,36 @@ async def health_check():
 async def upload_gmail_export(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    account_email: str = "default@gmail.com"
+    account_email: str = "default@gmail.com",
+    rag_pipeline: RAGPipeline = Depends(get_rag_pipeline),
+    summarizer_chain: SummarizerChain = Depends(get_summarizer_chain)
 ):
     """Upload and process Gmail export file"""
     try:
-        # Read uploaded file
-        content = await file.read()
-        
-        # Parse based on file type
+        # Parse based on file type, off the event loop
         if file.filename.endswith('.json'):
-            data = json.loads(content.decode('utf-8'))
-            emails = email_parser.parse_gmail_json(data, account_email)
+            # Stream messages out of the spooled upload instead of buffering the whole export
+            emails = await asyncio.to_thread(email_parser.parse_gmail_json_file, file.file, account_email)
         else:
-            # Assume EML format
-            emails = email_parser.parse_eml_content(content.decode('utf-8'), account_email)
+            # Assume EML format (a single message)
+            content = await file.read()
+            emails = await asyncio.to_thread(email_parser.parse_eml_content, content.decode('utf-8'), account_email)
+        
+        # Drop messages already stored (e.g. a re-uploaded export) before classification and insert;
+        # stored rows that are still unprocessed are picked up by /emails/process
+        stored_ids = await asyncio.to_thread(
+            db_manager.existing_gmail_ids,
+            [email_data.get('gmail_id') for email_data in emails]
+        )
+        new_emails = [email_data for email_data in emails if email_data.get('gmail_id') not in stored_ids]
         
         # Add background task to process emails
-        background_tasks.add_task(process_emails_batch, emails)
+        background_tasks.add_task(process_emails_batch, new_emails, summarizer_chain, rag_pipeline)
         
         return {
-            "message": f"Upload successful. Processing {len(emails)} emails.",
-            "email_count": len(emails),
+            "message": f"Upload successful. Processing {len(new_emails)} emails.",
+            "email_count": len(new_emails),
+            "skipped_existing": len(emails) - len(new_emails),
             "account": account_email
         }
         
@@ -121,12 +178,16 @@ async def upload_gmail_export(
         raise HTTPException(status_code=400, detail=f"Upload failed: {str(e)}")
 
 @app.post("/emails/process")
-async def process_emails_endpoint(background_tasks: BackgroundTasks):
+async def process_emails_endpoint(
+    background_tasks: BackgroundTasks,
+    rag_pipeline: RAGPipeline = Depends(get_rag_pipeline),
+    summarizer_chain: SummarizerChain = Depends(get_summarizer_chain)
+):
     """Process unprocessed emails"""
     try:
         # Get unprocessed emails
         with db_manager.SessionLocal() as db:
-            unprocessed = db.query(Email).filter(Email.is_processed == False).all()
+            unprocessed = db.query(Email).options(defer(Email.body)).filter(Email.is_processed == False).all()
         
         if not unprocessed:
             return {"message": "No unprocessed emails found"}
@@ -134,7 +195,9 @@ async def process_emails_endpoint(background_tasks: BackgroundTasks):
         # Add background task
         background_tasks.add_task(
             process_emails_batch, 
-            [email_to_dict(email) for email in unprocessed]
+            EmailOutList.dump_python(unprocessed),
+            summarizer_chain,
+            rag_pipeline
         )
         
         return {
@@ -147,7 +210,10 @@ async def process_emails_endpoint(background_tasks: BackgroundTasks):
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
 @app.post("/emails/classify")
-async def classify_email(request: ClassifyRequest):
+async def classify_email(
+    request: ClassifyRequest,
+    summarizer_chain: SummarizerChain = Depends(get_summarizer_chain)
+):
     """Classify a single email"""
     try:
         result = await summarizer_chain.classify_email(request.email_content)
@@ -161,12 +227,30 @@ async def get_emails(
     account: Optional[str] = None,
     category: Optional[str] = None,
     limit: int = 100,
-    offset: int = 0
+    offset: int = 0,
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    fields: Optional[str] = None
 ):
-    """Get emails with optional filtering"""
+    """
+    Get emails with optional filtering
+    Pass next_cursor's before/before_id to page without OFFSET, and fields
+    (comma-separated EmailOut names) to select and return only those columns
+    """
+    include = None
+    columns = defer(Email.body)
+    if fields:
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested - EmailOut.model_fields.keys()
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        include = {"__all__": requested}
+        # id and date_received are always loaded: keyset paging and next_cursor need them
+        columns = load_only(*(getattr(Email, field) for field in requested | {"id", "date_received"}))
+    
     try:
         with db_manager.SessionLocal() as db:
-            query = db.query(Email)
+            query = db.query(Email).options(columns)
             
             if account:
                 query = query.filter(Email.account_email == account)
@@ -174,12 +258,32 @@ async def get_emails(
             if category:
                 query = query.filter(Email.category == category)
             
-            emails = query.order_by(Email.date_received.desc()).offset(offset).limit(limit).all()
+            page = DatabaseManager.keyset_page(query, before, before_id)
+            if before is None:
+                # count(*) OVER() returns the filtered total alongside the page in one query
+                page = page.add_columns(func.count().over().label("total")).offset(offset)
+            rows = page.limit(limit).all()
+            
+            if before is None:
+                emails = [row[0] for row in rows]
+                total = rows[0].total if rows else (query.count() if offset else 0)
+            else:
+                # The cursor predicate would narrow a window count, so count the filter separately
+                emails = rows
+                total = query.count()
+            
+            next_cursor = None
+            if len(emails) == limit and emails[-1].date_received:
+                next_cursor = {
+                    "before": emails[-1].date_received.isoformat(),
+                    "before_id": emails[-1].id
+                }
             
             return {
-                "emails": [email_to_dict(email) for email in emails],
+                "emails": EmailOutList.dump_python(emails, mode="json", include=include),
                 "count": len(emails),
-                "total": query.count()
+                "total": total,
+                "next_cursor": next_cursor
             }
             
     except Exception as e:
@@ -203,8 +307,31 @@ async def get_stats():
         logger.error(f"Get stats failed: {e}")
         raise HTTPException(status_code=500, detail=f"Get stats failed: {str(e)}")
 
+@app.get("/dashboard")
+async def get_dashboard(limit: int = 10, llm_adapter: LLMAdapter = Depends(get_llm)):
+    """
+    Stats, recent emails and health in one response, so the dashboard needs a single round trip
+    Each part has the same shape as its standalone endpoint; an unhealthy service yields a health error
+    """
+    stats = await get_stats()
+    emails = await get_emails(limit=limit, fields=DASHBOARD_EMAIL_FIELDS)
+    try:
+        health = await health_check(llm_adapter)
+    except HTTPException as e:
+        health = {"error": e.detail}
+    
+    return {
+        "stats": stats,
+        "emails": emails,
+        "health": health
+    }
+
 @app.post("/query")
-async def query_emails(request: QueryRequest):
+async def query_emails(
+    request: QueryRequest,
+    llm_adapter: LLMAdapter = Depends(get_llm),
+    rag_pipeline: RAGPipeline = Depends(get_rag_pipeline)
+):
     """Query emails using RAG"""
     try:
         # Search similar emails
@@ -227,7 +354,10 @@ async def query_emails(request: QueryRequest):
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
 @app.get("/summary")
-async def get_summary(days: int = 7) -> SummaryResponse:
+async def get_summary(
+    days: int = 7,
+    summarizer_chain: SummarizerChain = Depends(get_summarizer_chain)
+) -> SummaryResponse:
     """Get job search summary"""
     try:
         # Get recent emails
@@ -261,7 +391,7 @@ async def get_summary(days: int = 7) -> SummaryResponse:
         raise HTTPException(status_code=500, detail=f"Get summary failed: {str(e)}")
 
 @app.delete("/emails/{email_id}")
-async def delete_email(email_id: int):
+async def delete_email(email_id: int, rag_pipeline: RAGPipeline = Depends(get_rag_pipeline)):
     """Delete an email"""
     try:
         with db_manager.SessionLocal() as db:
@@ -283,76 +413,162 @@ async def delete_email(email_id: int):
         raise HTTPException(status_code=500, detail=f"Delete email failed: {str(e)}")
 
 # Background task functions
-async def process_emails_batch(emails: List[Dict[str, Any]]):
-    """Background task to process emails"""
+PROCESS_MAX_CONCURRENCY = int(os.getenv("INSIGHT_MAX_CONCURRENCY", "8"))
+# Emails classified, committed and embedded per step, so a failure or crash loses at most one chunk
+PROCESS_CHUNK_SIZE = int(os.getenv("INSIGHT_PROCESS_CHUNK_SIZE", "50"))
+
+async def process_emails_batch(
+    emails: List[Dict[str, Any]],
+    summarizer_chain: SummarizerChain,
+    rag_pipeline: RAGPipeline
+):
+    """Background task to process emails, a bounded number at a time, committing every PROCESS_CHUNK_SIZE"""
     logger.info(f"Processing batch of {len(emails)} emails")
     
-    for email_data in emails:
-        try:
-            # Check if already processed
-            existing = db_manager.get_email_by_gmail_id(email_data.get('gmail_id'))
-            if existing and existing.is_processed:
-                continue
-            
-            # Classify email
-            email_content = f"{email_data.get('subject', '')} {email_data.get('snippet', '')}"
-            classification = await summarizer_chain.classify_email(email_content)
-            
-            # Store or update email
-            if existing:
-                db_manager.update_email_classification(
-                    existing.id,
-                    classification['category'],
-                    classification['summary'],
-                    classification['confidence']
-                )
-                email_id = existing.id
-            else:
-                email_data.update({
-                    'category': classification['category'],
-                    'summary': classification['summary'],
-                    'confidence_score': str(classification['confidence']),
-                    'is_processed': True
-                })
-                new_email = db_manager.add_email(email_data)
-                email_id = new_email.id
-            
-            # Add to vector store
-            embedding_id = f"{email_data.get('account_email')}_{email_data.get('gmail_id')}"
-            await rag_pipeline.add_email(
-                content=email_content,
-                metadata={
-                    'email_id': email_id,
-                    'account': email_data.get('account_email'),
-                    'category': classification['category'],
-                    'date': email_data.get('date_received')
-                },
-                embedding_id=embedding_id
-            )
-            
-            logger.info(f"Processed email {email_data.get('gmail_id')}: {classification['category']}")
-            
-        except Exception as e:
-            logger.error(f"Error processing email {email_data.get('gmail_id')}: {e}")
+    # One bulk lookup instead of a query per email
+    existing_map = await asyncio.to_thread(
+        db_manager.get_emails_by_gmail_ids,
+        [email_data.get('gmail_id') for email_data in emails]
+    )
+    
+    semaphore = asyncio.Semaphore(PROCESS_MAX_CONCURRENCY)
+    for start in range(0, len(emails), PROCESS_CHUNK_SIZE):
+        await _process_chunk(emails[start:start + PROCESS_CHUNK_SIZE], existing_map, semaphore, summarizer_chain, rag_pipeline)
+
+async def _process_chunk(
+    emails: List[Dict[str, Any]],
+    existing_map: Dict[str, Email],
+    semaphore: asyncio.Semaphore,
+    summarizer_chain: SummarizerChain,
+    rag_pipeline: RAGPipeline
+):
+    """Classify one chunk of a batch, commit its rows, then embed them"""
+    results = await asyncio.gather(
+        *[
+            _process_one(email_data, existing_map.get(email_data.get('gmail_id')), semaphore, summarizer_chain)
+            for email_data in emails
+        ],
+        return_exceptions=True
+    )
+    
+    classified = []
+    for email_data, result in zip(emails, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing email {email_data.get('gmail_id')}: {result}")
+        elif result:
+            classified.append(result)
+    
+    if not classified:
+        return
+    
+    # One session and one transaction for the chunk's writes
+    try:
+        to_embed = await asyncio.to_thread(_store_classifications, classified)
+    except Exception as e:
+        logger.error(f"Error storing chunk of {len(classified)} emails: {e}")
+        return
+    
+    # Embed and store the chunk in one vector-store call
+    try:
+        await rag_pipeline.add_emails(to_embed)
+    except Exception as e:
+        logger.error(f"Error embedding chunk of {len(to_embed)} emails: {e}")
+
+async def _process_one(
+    email_data: Dict[str, Any],
+    existing: Optional[Email],
+    semaphore: asyncio.Semaphore,
+    summarizer_chain: SummarizerChain
+) -> Optional[Tuple[Dict[str, Any], Optional[Email], Dict[str, Any]]]:
+    """Classify a single email, returning (email_data, existing row, classification) or None if skipped"""
+    async with semaphore:
+        # Skip emails that are already processed
+        if existing and existing.is_processed:
+            return None
+        
+        # Classify email
+        email_content = f"{email_data.get('subject', '')} {email_data.get('snippet', '')}"
+        classification = await summarizer_chain.classify_email(email_content)
+        
+        logger.info(f"Processed email {email_data.get('gmail_id')}: {classification['category']}")
+        return email_data, existing, classification
+
+def _store_classifications(
+    classified: List[Tuple[Dict[str, Any], Optional[Email], Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
+    """
+    Write a chunk's classifications in one transaction, returning the vector-store items
+    If that conflicts, the rows are retried one at a time so a single conflict only costs its own row
+    """
+    updates = {}
+    new_rows = {}
+    for email_data, existing, classification in classified:
+        if existing:
+            updates[existing.gmail_id] = {
+                'id': existing.id,
+                'category': classification['category'],
+                'summary': classification['summary'],
+                'confidence_score': str(classification['confidence']),
+                'is_processed': True,
+                'updated_at': datetime.utcnow()
+            }
+        else:
+            email_data.update({
+                'category': classification['category'],
+                'summary': classification['summary'],
+                'confidence_score': str(classification['confidence']),
+                'is_processed': True
+            })
+            # A repeated gmail_id within the batch would violate the unique index
+            new_rows.setdefault(email_data.get('gmail_id'), email_data)
+    
+    try:
+        email_ids = _write_classifications(updates, new_rows)
+    except IntegrityError as e:
+        # e.g. an overlapping upload stored one of these gmail_ids first; keep the rest of the chunk
+        logger.warning(f"Chunk write conflicted ({e.orig}); retrying {len(classified)} emails one at a time")
+        email_ids = {}
+        for gmail_id, update in updates.items():
+            email_ids.update(_write_classifications({gmail_id: update}, {}))
+        for gmail_id, email_data in new_rows.items():
+            try:
+                email_ids.update(_write_classifications({}, {gmail_id: email_data}))
+            except IntegrityError:
+                logger.warning(f"Skipping email {gmail_id}: already stored by another upload")
+    
+    # Keep sqlite_stat1 current so the planner sees the category/account skew of the new rows
+    if new_rows:
+        db_manager.update_statistics()
+    
+    items = {}
+    for email_data, _, classification in classified:
+        # Rows skipped on conflict are embedded by the upload that stored them
+        if email_data.get('gmail_id') not in email_ids:
             continue
+        embedding_id = f"{email_data.get('account_email')}_{email_data.get('gmail_id')}"
+        items.setdefault(embedding_id, {
+            'content': f"{email_data.get('subject', '')} {email_data.get('snippet', '')}",
+            'metadata': {
+                'email_id': email_ids.get(email_data.get('gmail_id')),
+                'account': email_data.get('account_email'),
+                'category': classification['category'],
+                'date': email_data.get('date_received')
+            },
+            'embedding_id': embedding_id
+        })
+    return list(items.values())
 
-def email_to_dict(email: Email) -> Dict[str, Any]:
-    """Convert Email model to dictionary"""
-    return {
-        "id": email.id,
-        "gmail_id": email.gmail_id,
-        "account_email": email.account_email,
-        "subject": email.subject,
-        "sender": email.sender,
-        "recipient": email.recipient,
-        "snippet": email.snippet,
-        "date_received": email.date_received.isoformat() if email.date_received else None,
-        "category": email.category,
-        "summary": email.summary,
-        "confidence_score": email.confidence_score,
-        "is_processed": email.is_processed,
-        "created_at": email.created_at.isoformat() if email.created_at else None
-    }
+def _write_classifications(updates: Dict[str, Dict[str, Any]], new_rows: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    """Apply updates and insert new rows (both keyed by gmail_id) in one transaction, returning gmail_id -> row id"""
+    with db_manager.SessionLocal() as db:
+        if updates:
+            db.bulk_update_mappings(Email, list(updates.values()))
+        # Parser dicts carry extra keys (labels, thread_id, ...); add_emails_bulk keeps the Email columns
+        db_manager.add_emails_bulk(list(new_rows.values()), session=db)
+        email_ids = db_manager.get_email_ids(list(new_rows), session=db)
+        email_ids.update((gmail_id, update['id']) for gmail_id, update in updates.items())
+        db.commit()
+    return email_ids
 
 if __name__ == "__main__":
     import uvicorn
@@ -2,18 +2,241 @@
 RAG (Retrieval-Augmented Generation) pipeline using Chroma and SentenceTransformers
 """
 import os
-import json
+import base64
+import asyncio
+import threading
 import numpy as np
-from typing import List, Dict, Any, Optional, Union
-from datetime import datetime
+from typing import List, Dict, Any, Optional, Union, Iterator
+from dataclasses import dataclass
+from datetime import datetime, timezone
 import logging
+from functools import lru_cache, partial
+from itertools import islice
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 import chromadb
 from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+from sentence_transformers import CrossEncoder, SentenceTransformer
 import pandas as pd
+import orjson
 
-from .utils import create_embedding_id, logger
+try:
+    import torch
+except ImportError:  # Optional with the ONNX/OpenVINO backends; skip torch thread tuning
+    torch = None
+
+try:
+    import onnxruntime
+except ImportError:  # Optional ONNX runtime; the ONNX backend is skipped without it
+    onnxruntime = None
+
+from .utils import LRUCache, cache_key, create_embedding_id, logger, parse_gmail_date
+
+# Prebuilt int8 export shipped with the sentence-transformers MiniLM models
+ONNX_INT8_MODEL_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+EMBED_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Inference threads for encoding; defaults to the CPUs this process may run on.
+# With several uvicorn/gunicorn workers, set this to roughly cores / workers
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0")) or (
+    len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+)
+# Cross-encoder used by semantic_search_with_reranking; empty disables it
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Candidates fetched per result when diversifying search results with MMR
+MMR_FETCH_FACTOR = 4
+
+# Rows per page when exporting the collection, and per add() when importing
+EXPORT_BATCH_SIZE = 5000
+IMPORT_CHUNK_SIZE = 2000
+# Emails encoded per step when add_emails overlaps encoding with Chroma writes
+INGEST_CHUNK_SIZE = EMBED_BATCH_SIZE * 4
+# Rows per page when recounting collection stats
+STATS_REBUILD_PAGE_SIZE = 10_000
+# Bumped when rebuild_stats gains a migration; older sidecars trigger one rebuild
+# (2: backfill date_epoch on rows stored before it existed)
+STATS_VERSION = 2
+# Embedding encodings export_embeddings can write
+EMBEDDING_EXPORT_DTYPES = ("float32", "float16", "int8")
+INT8_SCALE = 127.0
+
+# HNSW settings for a new collection; reset_collection re-tiers by size
+HNSW_DEFAULT_PARAMS = {
+    "hnsw:M": 24,
+    "hnsw:construction_ef": 128,
+    "hnsw:search_ef": 100,
+}
+
+# Per-query ef_search tiers for search_similar(search_ef=...)
+SEARCH_EF_FAST = 40
+SEARCH_EF_PRECISE = 200
+
+# (max vectors, M, construction_ef, search_ef), smallest tier first
+HNSW_TIERS = [
+    (10_000, 16, 64, 40),
+    (100_000, 24, 100, 100),
+    (None, 32, 128, 200),
+]
+
+@lru_cache(maxsize=10_000)
+def _tokens(text: str) -> frozenset:
+    """Lower-cased whitespace tokens, cached since the same documents recur across queries"""
+    return frozenset(text.lower().split())
+
+def _coerce_meta(meta: Dict[str, Any], _dt=(datetime, pd.Timestamp)) -> Dict[str, Any]:
+    """
+    Metadata as Chroma-native scalars, so where clauses can compare by type:
+    datetimes to ISO strings, numpy scalars unwrapped, other non-scalars to str, None dropped
+    """
+    return {
+        k: (
+            v.isoformat() if isinstance(v, _dt)
+            else v if isinstance(v, (str, int, float, bool))
+            else v.item() if isinstance(v, np.generic)
+            else str(v)
+        )
+        for k, v in meta.items() if v is not None
+    }
+
+def _quantize(embeddings: np.ndarray, dtype: str) -> np.ndarray:
+    """Convert unit-normalized float32 embeddings to an export dtype"""
+    if dtype == "int8":
+        # Components of unit vectors lie in [-1, 1]
+        return np.round(embeddings * INT8_SCALE).astype(np.int8)
+    return embeddings.astype(dtype)
+
+def _dequantize(embeddings: np.ndarray) -> np.ndarray:
+    """Back to float32 for Chroma, re-normalizing int8 rows"""
+    if embeddings.dtype == np.int8:
+        embeddings = embeddings.astype(np.float32) / INT8_SCALE
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms > 0, norms, 1)
+    return embeddings.astype(np.float32)
+
+@dataclass
+class SearchResults:
+    """Columnar search results; iterating yields the per-result dicts callers expect"""
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Dict[str, Any]]
+    distances: np.ndarray
+    similarities: np.ndarray
+    
+    @classmethod
+    def from_query(cls, results: Dict[str, Any], space: str = "cosine") -> "SearchResults":
+        """
+        Build from a single-query Chroma result
+        space is the collection's distance function; Chroma's l2 is squared, so on
+        unit vectors cosine similarity is 1 - d/2 there and 1 - d for cosine and ip
+        """
+        if not results['documents'] or not results['documents'][0]:
+            return cls.empty()
+        
+        distances = np.asarray(results['distances'][0], dtype=np.float32)
+        return cls(
+            ids=list(results['ids'][0]),
+            documents=results['documents'][0],
+            metadatas=[metadata or {} for metadata in results['metadatas'][0]],
+            distances=distances,
+            similarities=1 - distances / 2 if space == "l2" else 1 - distances
+        )
+    
+    @classmethod
+    def empty(cls) -> "SearchResults":
+        """Results for a search that matched nothing"""
+        return cls([], [], [], np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32))
+    
+    def __len__(self) -> int:
+        return len(self.documents)
+    
+    def row(self, i: int) -> Dict[str, Any]:
+        """Result i as a dict"""
+        return {
+            'content': self.documents[i],
+            'metadata': self.metadatas[i],
+            'similarity_score': float(self.similarities[i]),
+            'distance': float(self.distances[i])
+        }
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return (self.row(i) for i in range(len(self)))
+    
+    def take(self, indices: List[int]) -> "SearchResults":
+        """The results at indices, in that order"""
+        return SearchResults(
+            ids=[self.ids[i] for i in indices],
+            documents=[self.documents[i] for i in indices],
+            metadatas=[self.metadatas[i] for i in indices],
+            distances=self.distances[indices],
+            similarities=self.similarities[indices]
+        )
+
+def _collection_space(collection) -> str:
+    """Distance function of a Chroma collection; Chroma defaults to l2 when none was configured"""
+    try:
+        return collection.configuration["hnsw"]["space"]
+    except Exception:
+        return (collection.metadata or {}).get("hnsw:space", "l2")
+
+def _mmr(query: np.ndarray, candidates: np.ndarray, k: int, mmr_lambda: float) -> List[int]:
+    """Maximal marginal relevance: greedily pick k candidate rows balancing query similarity and novelty"""
+    sim_to_query = candidates @ query
+    sim_inter = candidates @ candidates.T
+    
+    selected = []
+    # Highest similarity to anything already selected
+    max_sim_selected = np.full(len(candidates), -np.inf, dtype=np.float32)
+    for _ in range(min(k, len(candidates))):
+        if selected:
+            scores = mmr_lambda * sim_to_query - (1 - mmr_lambda) * max_sim_selected
+        else:
+            scores = sim_to_query.copy()
+        scores[selected] = -np.inf
+        
+        best = int(np.argmax(scores))
+        selected.append(best)
+        max_sim_selected = np.maximum(max_sim_selected, sim_inter[:, best])
+    return selected
+
+class _SharedExclusiveLock:
+    """Any number of shared holders or one exclusive holder; waiting exclusive holders go first"""
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+    
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._cond:
+            while self._exclusive or self._exclusive_waiting:
+                self._cond.wait()
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                if not self._shared:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._cond:
+            self._exclusive_waiting += 1
+            while self._exclusive or self._shared:
+                self._cond.wait()
+            self._exclusive_waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
 
 class RAGPipeline:
     """RAG pipeline for email search and retrieval"""
@@ -26,26 +249,95 @@ class RAGPipeline:
         self.collection_name = collection_name
         self.embedding_model_name = embedding_model
         self.persist_directory = persist_directory
+        self.embedding_cache = LRUCache(maxsize=4096)
+        # Kept apart from embedding_cache so bulk ingest can't evict hot queries
+        self.query_cache = LRUCache(maxsize=2048)
+        self._reranker = None
+        # Default queries share it; a per-query search_ef override holds it exclusively
+        self._search_ef_lock = _SharedExclusiveLock()
+        # One thread owns the model and the embedding caches; Chroma calls use the default executor
+        self._encode_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-encode")
+        self._reranker_failed = not RERANKER_MODEL
+        
+        self._configure_torch_threads()
         
         # Initialize embedding model
         try:
-            self.embedding_model = SentenceTransformer(embedding_model)
+            self.embedding_model = self._load_model(embedding_model)
             logger.info(f"Loaded embedding model: {embedding_model}")
         except Exception as e:
             logger.error(f"Failed to load embedding model {embedding_model}: {e}")
             # Fallback to a smaller model
             try:
-                self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+                self.embedding_model = self._load_model("all-MiniLM-L6-v2")
                 logger.info("Using fallback embedding model: all-MiniLM-L6-v2")
             except Exception as fallback_error:
                 logger.error(f"Failed to load fallback model: {fallback_error}")
                 raise Exception("Could not initialize any embedding model")
         
+        self._emb_dim = int(self.embedding_model.get_sentence_embedding_dimension())
+        # Shared read-only, like cached embeddings
+        self._zero_vec = np.zeros(self._emb_dim, dtype=np.float32)
+        self._zero_vec.setflags(write=False)
+        
         # Initialize Chroma client
         self._init_chroma_client()
         
         # Get or create collection
         self.collection = self._get_or_create_collection()
+        
+        # Category/account counts, kept in a sidecar file instead of scanning metadata
+        self.stats_path = os.path.join(self.persist_directory, f"{self.collection_name}_stats.json")
+        self._stats_lock = threading.Lock()
+        self._load_stats()
+    
+    @staticmethod
+    def _load_model(model_name: str, model_cls=SentenceTransformer):
+        """Load a sentence-transformers model on the int8 ONNX backend, then OpenVINO, then PyTorch FP32"""
+        onnx_kwargs = {"file_name": ONNX_INT8_MODEL_FILE}
+        if onnxruntime is not None:
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = EMBEDDING_THREADS
+            session_options.inter_op_num_threads = 1
+            onnx_kwargs["session_options"] = session_options
+        
+        backends = [
+            ("onnx", onnx_kwargs),
+            ("openvino", None),
+        ]
+        for backend, model_kwargs in backends:
+            try:
+                model = model_cls(model_name, backend=backend, model_kwargs=model_kwargs)
+                logger.info(f"Using {backend} backend for {model_name}")
+                return model
+            except Exception as e:
+                logger.info(f"{backend} backend unavailable for {model_name}: {e}")
+        
+        return model_cls(model_name)
+    
+    @staticmethod
+    def _configure_torch_threads():
+        """Match torch's intra-op threads to EMBEDDING_THREADS, with a single inter-op thread"""
+        if torch is None:
+            return
+        
+        torch.set_num_threads(EMBEDDING_THREADS)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only settable before torch starts parallel work, e.g. a second pipeline
+            pass
+    
+    def _get_reranker(self):
+        """Cross-encoder reranker, loaded on first use; None if disabled or unavailable"""
+        if self._reranker is None and not self._reranker_failed:
+            try:
+                self._reranker = self._load_model(RERANKER_MODEL, CrossEncoder)
+                logger.info(f"Loaded reranker model: {RERANKER_MODEL}")
+            except Exception as e:
+                logger.warning(f"Reranker unavailable, using keyword overlap: {e}")
+                self._reranker_failed = True
+        return self._reranker
     
     def _init_chroma_client(self):
         """Initialize ChromaDB client"""
@@ -67,12 +359,19 @@ class RAGPipeline:
             self.client = chromadb.Client()
             logger.warning("Using in-memory Chroma client (data will not persist)")
     
-    def _get_or_create_collection(self):
-        """Get or create the email collection"""
+    def _get_or_create_collection(self, hnsw_params: Optional[Dict[str, Any]] = None):
+        """Get or create the email collection, creating it with the given HNSW parameters"""
         try:
             # Try to get existing collection
             collection = self.client.get_collection(name=self.collection_name)
             logger.info(f"Found existing collection: {self.collection_name}")
+            
+            self._distance_space = _collection_space(collection)
+            if self._distance_space == "l2":
+                logger.warning(
+                    f"Collection {self.collection_name} uses l2 distance; converting to cosine "
+                    f"similarity as 1 - d/2. Call reset_collection() to rebuild it with cosine space"
+                )
             return collection
             
         except Exception:
@@ -80,113 +379,254 @@ class RAGPipeline:
             try:
                 collection = self.client.create_collection(
                     name=self.collection_name,
-                    metadata={"description": "InSightMail email embeddings"}
+                    metadata={
+                        "description": "InSightMail email embeddings",
+                        # Embeddings are unit-normalized, so 1 - distance is cosine similarity
+                        "hnsw:space": "cosine",
+                        **(hnsw_params or HNSW_DEFAULT_PARAMS),
+                        "hnsw:num_threads": os.cpu_count() or 1
+                    }
                 )
                 logger.info(f"Created new collection: {self.collection_name}")
+                self._distance_space = "cosine"
                 return collection
                 
             except Exception as e:
                 logger.error(f"Failed to create collection: {e}")
                 raise
     
-    def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for text"""
+    def configure_hnsw_params(self, vector_count: Optional[int] = None) -> Dict[str, int]:
+        """HNSW parameters sized for vector_count (defaults to the current collection size)"""
+        if vector_count is None:
+            vector_count = self.collection.count()
+        
+        for max_vectors, m, construction_ef, search_ef in HNSW_TIERS:
+            if max_vectors is None or vector_count < max_vectors:
+                return {
+                    "hnsw:M": m,
+                    "hnsw:construction_ef": construction_ef,
+                    "hnsw:search_ef": search_ef
+                }
+    
+    def _set_search_ef(self, search_ef: int) -> int:
+        """Set the collection's query-time ef, returning the previous value"""
+        previous = self.collection.configuration["hnsw"]["ef_search"]
+        if search_ef != previous:
+            self.collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+        return previous
+    
+    def generate_embedding(self, text: str) -> np.ndarray:
+        """Generate a float32 embedding for text"""
         try:
             if not text or not text.strip():
                 # Return zero vector for empty text
-                return [0.0] * self.embedding_model.get_sentence_embedding_dimension()
+                return self._zero_vec
+            
+            # Templated emails (auto-replies, rejections) often repeat verbatim
+            key = cache_key(self.embedding_model_name, text)
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                return cached
             
-            embedding = self.embedding_model.encode(text, convert_to_tensor=False)
-            return embedding.tolist()
+            embedding = self.embedding_model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+            embedding = np.asarray(embedding, dtype=np.float32)
+            # Cached arrays are shared between callers
+            embedding.setflags(write=False)
+            self.embedding_cache.set(key, embedding)
+            return embedding
             
         except Exception as e:
             logger.error(f"Failed to generate embedding: {e}")
             # Return zero vector on error
-            dim = getattr(self.embedding_model, 'get_sentence_embedding_dimension', lambda: 384)()
-            return [0.0] * dim
+            return self._zero_vec
+    
+    def generate_query_embedding(self, query: str) -> np.ndarray:
+        """Generate an embedding for a search query, cached separately from documents"""
+        key = cache_key(self.embedding_model_name, query)
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        embedding = self.generate_embedding(query)
+        self.query_cache.set(key, embedding)
+        return embedding
+    
+    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate a (len(texts), dim) float32 array of embeddings with a single encode call"""
+        embeddings = np.zeros((len(texts), self._emb_dim), dtype=np.float32)
+        missing = []
+        
+        for i, text in enumerate(texts):
+            # Empty texts keep their zero row
+            if text and text.strip():
+                cached = self.embedding_cache.get(cache_key(self.embedding_model_name, text))
+                if cached is None:
+                    missing.append(i)
+                else:
+                    embeddings[i] = cached
+        
+        if missing:
+            # Encode longest-first so each batch pads to similar lengths
+            missing.sort(key=lambda i: len(texts[i]), reverse=True)
+            encoded = self.embedding_model.encode(
+                [texts[i] for i in missing],
+                batch_size=EMBED_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            embeddings[missing] = encoded
+            for i in missing:
+                vector = embeddings[i].copy()
+                vector.setflags(write=False)
+                self.embedding_cache.set(cache_key(self.embedding_model_name, texts[i]), vector)
+        
+        return embeddings
     
     async def add_email(self, 
                        content: str,
                        metadata: Dict[str, Any],
                        embedding_id: Optional[str] = None) -> str:
         """Add email to vector store"""
+        ids = await self.add_emails([{
+            'content': content,
+            'metadata': metadata,
+            'embedding_id': embedding_id
+        }])
+        return ids[0]
+    
+    async def add_emails(self, items: List[Dict[str, Any]]) -> List[str]:
+        """
+        Add several emails to the vector store, encoding each chunk while the previous one is written
+        Each item has 'content', 'metadata' and optionally 'embedding_id'
+        """
+        if not items:
+            return []
+        
         try:
-            # Generate embedding ID if not provided
-            if not embedding_id:
-                embedding_id = create_embedding_id(
-                    str(metadata.get('email_id', 'unknown')),
-                    metadata.get('account', 'default')
+            ids = [
+                item.get('embedding_id') or create_embedding_id(
+                    str(item['metadata'].get('email_id', 'unknown')),
+                    item['metadata'].get('account', 'default')
                 )
+                for item in items
+            ]
+            contents = [item['content'] for item in items]
+            metadatas = [self._prepare_metadata(item['metadata']) for item in items]
             
-            # Generate embedding
-            embedding = self.generate_embedding(content)
-            
-            # Prepare metadata (Chroma requires string values)
-            chroma_metadata = {}
-            for key, value in metadata.items():
-                if value is not None:
-                    if isinstance(value, (datetime, pd.Timestamp)):
-                        chroma_metadata[key] = value.isoformat()
-                    else:
-                        chroma_metadata[key] = str(value)
-            
-            # Add to collection
-            self.collection.add(
-                embeddings=[embedding],
-                documents=[content],
-                metadatas=[chroma_metadata],
-                ids=[embedding_id]
-            )
-            
-            logger.info(f"Added email embedding: {embedding_id}")
-            return embedding_id
+            # Encode chunk i + 1 while chunk i is written to Chroma
+            loop = asyncio.get_running_loop()
+            pending_add = None
+            try:
+                for start in range(0, len(items), INGEST_CHUNK_SIZE):
+                    end = start + INGEST_CHUNK_SIZE
+                    embeddings = await loop.run_in_executor(
+                        self._encode_pool, self.generate_embeddings, contents[start:end]
+                    )
+                    if pending_add is not None:
+                        await pending_add
+                    pending_add = loop.run_in_executor(
+                        None, self._add_batch, ids[start:end], embeddings, contents[start:end], metadatas[start:end]
+                    )
+            finally:
+                if pending_add is not None:
+                    await pending_add
             
+            logger.info(f"Added {len(ids)} email embeddings")
+            return ids
+        
         except Exception as e:
-            logger.error(f"Failed to add email embedding: {e}")
+            logger.error(f"Failed to add email embeddings: {e}")
             raise
     
+    def _add_batch(self,
+                   ids: List[str],
+                   embeddings: np.ndarray,
+                   contents: List[str],
+                   metadatas: List[Dict[str, Any]]):
+        """Write one encoded batch to the collection and count it in the stats"""
+        self.collection.add(
+            embeddings=embeddings,
+            documents=contents,
+            metadatas=metadatas,
+            ids=ids
+        )
+        self._update_stats(added=metadatas)
+    
     async def search_similar(self, 
                            query: str, 
                            k: int = 10,
-                           filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
-        """Search for similar emails"""
+                           filter_metadata: Optional[Dict[str, Any]] = None,
+                           search_ef: Optional[int] = None,
+                           mmr_lambda: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Search for similar emails
+        search_ef overrides HNSW ef_search for this query (SEARCH_EF_FAST for
+        typeahead, SEARCH_EF_PRECISE for analytical queries); mmr_lambda (e.g. 0.7)
+        trades relevance for diversity among the results
+        """
+        return list(await self.search_similar_results(query, k, filter_metadata, search_ef, mmr_lambda))
+    
+    async def search_similar_results(self,
+                                     query: str,
+                                     k: int = 10,
+                                     filter_metadata: Optional[Dict[str, Any]] = None,
+                                     search_ef: Optional[int] = None,
+                                     mmr_lambda: Optional[float] = None) -> SearchResults:
+        """Search for similar emails, keeping Chroma's columnar layout"""
         try:
+            loop = asyncio.get_running_loop()
+            
             # Generate query embedding
-            query_embedding = self.generate_embedding(query)
+            query_embedding = await loop.run_in_executor(self._encode_pool, self.generate_query_embedding, query)
             
             # Prepare where filter
-            where_filter = None
-            if filter_metadata:
-                where_filter = {}
-                for key, value in filter_metadata.items():
-                    if value is not None:
-                        where_filter[key] = str(value)
+            where_filter = _coerce_meta(filter_metadata or {}) or None
+            
+            # MMR needs a wider candidate pool and the candidates' vectors
+            n_results = k
+            include = ["documents", "metadatas", "distances"]
+            if mmr_lambda is not None:
+                n_results = k * MMR_FETCH_FACTOR
+                include.append("embeddings")
             
             # Search in collection
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=k,
+            query_kwargs = dict(
+                query_embeddings=query_embedding[None, :],
+                n_results=n_results,
                 where=where_filter,
-                include=["documents", "metadatas", "distances"]
+                include=include
             )
+            results = await loop.run_in_executor(None, partial(self._query, search_ef, **query_kwargs))
             
-            # Format results
-            formatted_results = []
-            if results['documents'] and results['documents'][0]:
-                for i in range(len(results['documents'][0])):
-                    formatted_results.append({
-                        'content': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                        'similarity_score': 1 - results['distances'][0][i] if results['distances'] else 0.0,
-                        'distance': results['distances'][0][i] if results['distances'] else 1.0
-                    })
+            search_results = SearchResults.from_query(results, self._distance_space)
+            if mmr_lambda is not None and len(search_results) > k:
+                candidates = np.asarray(results['embeddings'][0], dtype=np.float32)
+                search_results = search_results.take(_mmr(query_embedding, candidates, k, mmr_lambda))
             
-            logger.info(f"Found {len(formatted_results)} similar emails for query: {query[:50]}...")
-            return formatted_results
+            logger.info(f"Found {len(search_results)} similar emails for query: {query[:50]}...")
+            return search_results
             
         except Exception as e:
             logger.error(f"Search failed: {e}")
-            return []
+            return SearchResults.empty()
+    
+    def _query(self, search_ef: Optional[int] = None, **query_kwargs) -> Dict[str, Any]:
+        """
+        Run collection.query, applying a per-query search_ef if given
+        ef_search is collection-wide, so an override runs alone: default queries wait
+        until it is restored. Chroma persists modify(), so a crash between set and
+        restore leaves the collection at the override until reset_collection rebuilds it
+        """
+        if not search_ef:
+            with self._search_ef_lock.shared():
+                return self.collection.query(**query_kwargs)
+        
+        with self._search_ef_lock.exclusive():
+            previous_ef = self._set_search_ef(search_ef)
+            try:
+                return self.collection.query(**query_kwargs)
+            finally:
+                self._set_search_ef(previous_ef)
     
     async def search_by_category(self, 
                                category: str, 
@@ -202,44 +642,30 @@ class RAGPipeline:
                                 start_date: str,
                                 end_date: Optional[str] = None,
                                 k: int = 10) -> List[Dict[str, Any]]:
-        """Search emails by date range"""
+        """Search emails by date range (inclusive YYYY-MM-DD bounds), newest first"""
         try:
-            # For simple date filtering, we'll use the query with date context
-            date_query = f"emails from {start_date}"
+            start_epoch = self._day_epoch(start_date)
+            where_filter = {'date_epoch': {'$gte': start_epoch}}
             if end_date:
-                date_query += f" to {end_date}"
+                end_epoch = self._day_epoch(end_date) + 86399
+                where_filter = {'$and': [where_filter, {'date_epoch': {'$lte': end_epoch}}]}
             
-            # Get all results first (Chroma doesn't support complex date filtering easily)
-            all_results = self.collection.get(
+            # Only matching rows come back; rows predating date_epoch are backfilled by rebuild_stats
+            results = self.collection.get(
+                where=where_filter,
                 include=["documents", "metadatas"]
             )
             
-            # Filter by date manually
-            filtered_results = []
-            if all_results['documents']:
-                for i, doc in enumerate(all_results['documents']):
-                    metadata = all_results['metadatas'][i] if all_results['metadatas'] else {}
-                    email_date = metadata.get('date', '')
-                    
-                    if email_date:
-                        try:
-                            # Simple date comparison (YYYY-MM-DD format)
-                            if start_date <= email_date[:10]:
-                                if not end_date or email_date[:10] <= end_date:
-                                    filtered_results.append({
-                                        'content': doc,
-                                        'metadata': metadata,
-                                        'similarity_score': 1.0,
-                                        'distance': 0.0
-                                    })
-                        except Exception:
-                            continue
-            
-            # Sort by date (newest first) and limit
-            filtered_results.sort(
-                key=lambda x: x['metadata'].get('date', ''), 
-                reverse=True
-            )
+            filtered_results = [
+                {
+                    'content': doc,
+                    'metadata': metadata,
+                    'similarity_score': 1.0,
+                    'distance': 0.0
+                }
+                for doc, metadata in zip(results['documents'] or [], results['metadatas'] or [])
+            ]
+            filtered_results.sort(key=lambda x: x['metadata']['date_epoch'], reverse=True)
             
             return filtered_results[:k]
             
@@ -247,33 +673,48 @@ class RAGPipeline:
             logger.error(f"Date search failed: {e}")
             return []
     
+    @staticmethod
+    def _day_epoch(day: str) -> int:
+        """Epoch seconds at UTC midnight for a YYYY-MM-DD date"""
+        return int(datetime.strptime(day[:10], "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+    
     async def get_similar_to_email(self, 
                                  email_id: str,
                                  k: int = 5) -> List[Dict[str, Any]]:
-        """Find emails similar to a specific email"""
+        """Find emails similar to a specific email, reusing its stored embedding"""
         try:
-            # Get the email content first
-            results = self.collection.get(
+            source = self.collection.get(
                 ids=[email_id],
-                include=["documents"]
+                include=["embeddings", "metadatas"]
             )
             
-            if not results['documents'] or not results['documents'][0]:
+            if not source['ids']:
                 logger.warning(f"Email {email_id} not found in vector store")
                 return []
             
-            email_content = results['documents'][0]
+            embedding = np.asarray(source['embeddings'][0], dtype=np.float32)
+            source_email_id = (source['metadatas'][0] or {}).get('email_id')
             
-            # Search for similar emails (excluding the original)
-            similar = await self.search_similar(email_content, k=k+1)
-            
-            # Filter out the original email
-            filtered_similar = [
-                result for result in similar 
-                if result['metadata'].get('email_id') != email_id
-            ]
+            # Exclude the original email in the query itself when it carries an email_id
+            if source_email_id is not None:
+                results = self._query(
+                    query_embeddings=embedding[None, :],
+                    n_results=k,
+                    where={'email_id': {'$ne': source_email_id}},
+                    include=["documents", "metadatas", "distances"]
+                )
+                return list(SearchResults.from_query(results, self._distance_space))
             
-            return filtered_similar[:k]
+            results = self._query(
+                query_embeddings=embedding[None, :],
+                n_results=k + 1,
+                include=["documents", "metadatas", "distances"]
+            )
+            similar = SearchResults.from_query(results, self._distance_space)
+            return [
+                similar.row(i) for i, result_id in enumerate(similar.ids)
+                if result_id != email_id
+            ][:k]
             
         except Exception as e:
             logger.error(f"Similar email search failed: {e}")
@@ -282,7 +723,10 @@ class RAGPipeline:
     async def delete_embedding(self, embedding_id: str) -> bool:
         """Delete an embedding from the vector store"""
         try:
+            old_metadata = self._get_metadata(embedding_id)
             self.collection.delete(ids=[embedding_id])
+            if old_metadata is not None:
+                self._update_stats(removed=[old_metadata])
             logger.info(f"Deleted embedding: {embedding_id}")
             return True
             
@@ -297,24 +741,21 @@ class RAGPipeline:
         """Update an existing embedding"""
         try:
             # Generate new embedding
-            embedding = self.generate_embedding(content)
+            loop = asyncio.get_running_loop()
+            embedding = await loop.run_in_executor(self._encode_pool, self.generate_embedding, content)
             
             # Prepare metadata
-            chroma_metadata = {}
-            for key, value in metadata.items():
-                if value is not None:
-                    if isinstance(value, (datetime, pd.Timestamp)):
-                        chroma_metadata[key] = value.isoformat()
-                    else:
-                        chroma_metadata[key] = str(value)
+            chroma_metadata = self._prepare_metadata(metadata)
             
             # Update in collection
+            old_metadata = self._get_metadata(embedding_id)
             self.collection.update(
                 ids=[embedding_id],
-                embeddings=[embedding],
+                embeddings=embedding[None, :],
                 documents=[content],
                 metadatas=[chroma_metadata]
             )
+            self._replace_stats(old_metadata, chroma_metadata)
             
             logger.info(f"Updated embedding: {embedding_id}")
             return True
@@ -323,35 +764,35 @@ class RAGPipeline:
             logger.error(f"Failed to update embedding {embedding_id}: {e}")
             return False
     
+    @staticmethod
+    def _prepare_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Convert metadata to Chroma-compatible values (see _coerce_meta)
+        Each datetime field (and a parseable 'date' string) also gets an integer
+        '<field>_epoch' in UTC seconds for range filters
+        """
+        chroma_metadata = _coerce_meta(metadata)
+        
+        for key, value in metadata.items():
+            if key == 'date' and isinstance(value, str):
+                value = parse_gmail_date(value)
+            if isinstance(value, datetime):
+                if value.tzinfo is None:
+                    value = value.replace(tzinfo=timezone.utc)
+                chroma_metadata[f'{key}_epoch'] = int(value.timestamp())
+        return chroma_metadata
+    
     def get_collection_stats(self) -> Dict[str, Any]:
         """Get statistics about the collection"""
         try:
-            # Get collection info
-            collection_count = self.collection.count()
-            
-            # Get sample of metadata to analyze
-            sample_results = self.collection.get(
-                limit=min(100, collection_count),
-                include=["metadatas"]
-            )
-            
-            # Analyze categories
-            categories = {}
-            accounts = set()
-            
-            if sample_results['metadatas']:
-                for metadata in sample_results['metadatas']:
-                    category = metadata.get('category', 'Unknown')
-                    categories[category] = categories.get(category, 0) + 1
-                    
-                    account = metadata.get('account')
-                    if account:
-                        accounts.add(account)
+            with self._stats_lock:
+                categories = dict(self._category_counts)
+                unique_accounts = len(self._account_counts)
             
             return {
-                'total_embeddings': collection_count,
+                'total_embeddings': self.collection.count(),
                 'categories': categories,
-                'unique_accounts': len(accounts),
+                'unique_accounts': unique_accounts,
                 'collection_name': self.collection_name,
                 'embedding_model': self.embedding_model_name
             }
@@ -365,6 +806,112 @@ class RAGPipeline:
                 'error': str(e)
             }
     
+    def rebuild_stats(self):
+        """
+        Recount categories and accounts from the stored metadata
+        Rows stored before date_epoch existed get it backfilled from 'date' on the way
+        """
+        category_counts = Counter()
+        account_counts = Counter()
+        total = self.collection.count()
+        backfilled = 0
+        
+        for offset in range(0, total, STATS_REBUILD_PAGE_SIZE):
+            page = self.collection.get(
+                limit=STATS_REBUILD_PAGE_SIZE,
+                offset=offset,
+                include=["metadatas"]
+            )
+            update_ids, update_metadatas = [], []
+            for embedding_id, metadata in zip(page['ids'], page['metadatas']):
+                metadata = metadata or {}
+                self._count_metadata(category_counts, account_counts, metadata, 1)
+                if 'date_epoch' not in metadata and isinstance(metadata.get('date'), str):
+                    epoch_metadata = self._prepare_metadata({'date': metadata['date']})
+                    if 'date_epoch' in epoch_metadata:
+                        update_ids.append(embedding_id)
+                        update_metadatas.append({**metadata, 'date_epoch': epoch_metadata['date_epoch']})
+            if update_ids:
+                self.collection.update(ids=update_ids, metadatas=update_metadatas)
+                backfilled += len(update_ids)
+        
+        if backfilled:
+            logger.info(f"Backfilled date_epoch on {backfilled} embeddings")
+        
+        with self._stats_lock:
+            self._category_counts = category_counts
+            self._account_counts = account_counts
+            self._save_stats()
+        logger.info(f"Rebuilt stats for {total} embeddings")
+    
+    def _load_stats(self):
+        """Load the stats sidecar, rebuilding it if missing or out of step with the collection"""
+        try:
+            with open(self.stats_path, 'rb') as f:
+                saved = orjson.loads(f.read())
+            if saved.get('version') == STATS_VERSION and saved.get('total') == self.collection.count():
+                self._category_counts = Counter(saved['categories'])
+                self._account_counts = Counter(saved['accounts'])
+                return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable stats file {self.stats_path}: {e}")
+        
+        self.rebuild_stats()
+    
+    def _save_stats(self):
+        """Write the stats sidecar; callers hold _stats_lock"""
+        try:
+            tmp_path = f"{self.stats_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps({
+                    'version': STATS_VERSION,
+                    'total': sum(self._category_counts.values()),
+                    'categories': self._category_counts,
+                    'accounts': self._account_counts
+                }))
+            os.replace(tmp_path, self.stats_path)
+        except Exception as e:
+            logger.warning(f"Failed to save stats file {self.stats_path}: {e}")
+    
+    @staticmethod
+    def _count_metadata(category_counts: Counter, account_counts: Counter, metadata: Dict[str, Any], delta: int):
+        """Apply one row's metadata to the counters, dropping keys that reach zero"""
+        category = str(metadata.get('category', 'Unknown'))
+        category_counts[category] += delta
+        if category_counts[category] <= 0:
+            del category_counts[category]
+        
+        account = metadata.get('account')
+        if account:
+            account_counts[str(account)] += delta
+            if account_counts[str(account)] <= 0:
+                del account_counts[str(account)]
+    
+    def _update_stats(self,
+                      added: Optional[List[Dict[str, Any]]] = None,
+                      removed: Optional[List[Dict[str, Any]]] = None):
+        """Count added rows and uncount removed ones, then persist"""
+        with self._stats_lock:
+            for metadata in removed or []:
+                self._count_metadata(self._category_counts, self._account_counts, metadata, -1)
+            for metadata in added or []:
+                self._count_metadata(self._category_counts, self._account_counts, metadata, 1)
+            self._save_stats()
+    
+    def _replace_stats(self, old_metadata: Optional[Dict[str, Any]], new_metadata: Dict[str, Any]):
+        """Recount a row whose metadata was updated (Chroma merges updated keys)"""
+        if old_metadata is not None:
+            self._update_stats(added=[{**old_metadata, **new_metadata}], removed=[old_metadata])
+    
+    def _get_metadata(self, embedding_id: str) -> Optional[Dict[str, Any]]:
+        """Stored metadata for an embedding, or None if it doesn't exist"""
+        existing = self.collection.get(ids=[embedding_id], include=["metadatas"])
+        if not existing['ids']:
+            return None
+        return existing['metadatas'][0] or {}
+    
     async def semantic_search_with_reranking(self, 
                                            query: str,
                                            k: int = 20,
@@ -372,71 +919,91 @@ class RAGPipeline:
         """Search with additional reranking for better results"""
         try:
             # Initial search with higher k
-            initial_results = await self.search_similar(query, k=k)
+            initial_results = await self.search_similar_results(query, k=k)
             
             if len(initial_results) <= rerank_top_k:
-                return initial_results
-            
-            # Re-rank using cross-encoder or more sophisticated scoring
-            # For now, we'll use a simple relevance scoring based on keyword overlap
-            reranked = self._rerank_results(query, initial_results)
+                return list(initial_results)
             
-            return reranked[:rerank_top_k]
+            return self._rerank_results(query, initial_results, top_k=rerank_top_k)
             
         except Exception as e:
             logger.error(f"Semantic search with reranking failed: {e}")
             return []
     
-    def _rerank_results(self, query: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Simple reranking based on keyword overlap"""
+    def _rerank_results(self,
+                        query: str,
+                        results: SearchResults,
+                        top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Rerank with the cross-encoder, or keyword overlap without one, returning the top_k results"""
         try:
-            query_words = set(query.lower().split())
-            
-            for result in results:
-                content = result['content'].lower()
-                content_words = set(content.split())
-                
-                # Calculate keyword overlap
-                overlap = len(query_words.intersection(content_words))
-                overlap_score = overlap / len(query_words) if query_words else 0
-                
-                # Combine with original similarity
-                original_similarity = result.get('similarity_score', 0)
-                combined_score = 0.7 * original_similarity + 0.3 * overlap_score
-                
-                result['rerank_score'] = combined_score
+            reranker = self._get_reranker()
+            if reranker is not None:
+                pairs = [(query, document) for document in results.documents]
+                scores = np.asarray(reranker.predict(pairs, batch_size=32, convert_to_numpy=True), dtype=np.float32)
+            else:
+                scores = self._keyword_scores(query, results)
             
-            # Sort by rerank score
-            return sorted(results, key=lambda x: x.get('rerank_score', 0), reverse=True)
+            # Sort by rerank score, only building dicts for the results returned
+            order = np.argsort(-scores, kind='stable')[:top_k]
+            return [
+                {**results.row(i), 'rerank_score': float(scores[i])}
+                for i in order
+            ]
             
         except Exception as e:
             logger.error(f"Reranking failed: {e}")
-            return results
+            return list(results)[:top_k]
     
-    async def export_embeddings(self, output_path: str) -> bool:
-        """Export embeddings to JSON file for backup"""
+    @staticmethod
+    def _keyword_scores(query: str, results: SearchResults) -> np.ndarray:
+        """Blend similarity with the fraction of query words found in each result"""
+        query_words = _tokens(query)
+        
+        # Calculate keyword overlap
+        overlaps = np.array([len(query_words & _tokens(document)) for document in results.documents], dtype=np.float32)
+        overlap_scores = overlaps / len(query_words) if query_words else np.zeros(len(results), dtype=np.float32)
+        
+        # Combine with original similarity
+        return 0.7 * results.similarities + 0.3 * overlap_scores
+    
+    async def export_embeddings(self, output_path: str, embedding_dtype: str = "float32") -> bool:
+        """
+        Export embeddings to a JSONL file for backup
+        The first line is a header; each further line is one row with its
+        embedding stored as base64 bytes of embedding_dtype ("float32", or the
+        lossy "float16" / "int8" for half / quarter size backups)
+        """
         try:
-            all_data = self.collection.get(
-                include=["documents", "metadatas", "embeddings"]
-            )
+            if embedding_dtype not in EMBEDDING_EXPORT_DTYPES:
+                raise ValueError(f"Unsupported embedding dtype: {embedding_dtype}")
             
-            export_data = {
-                'collection_name': self.collection_name,
-                'embedding_model': self.embedding_model_name,
-                'export_date': datetime.now().isoformat(),
-                'total_count': len(all_data['ids']) if all_data['ids'] else 0,
-                'data': {
-                    'ids': all_data['ids'],
-                    'documents': all_data['documents'],
-                    'metadatas': all_data['metadatas'],
-                    'embeddings': all_data['embeddings']
-                }
-            }
+            total_count = self.collection.count()
             
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, indent=2, default=str)
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps({
+                    'collection_name': self.collection_name,
+                    'embedding_model': self.embedding_model_name,
+                    'export_date': datetime.now().isoformat(),
+                    'total_count': total_count,
+                    'embedding_dtype': embedding_dtype
+                }) + b'\n')
+                
+                for offset in range(0, total_count, EXPORT_BATCH_SIZE):
+                    page = self.collection.get(
+                        limit=EXPORT_BATCH_SIZE,
+                        offset=offset,
+                        include=["documents", "metadatas", "embeddings"]
+                    )
+                    embeddings = _quantize(np.asarray(page['embeddings'], dtype=np.float32), embedding_dtype)
+                    for i, embedding_id in enumerate(page['ids']):
+                        f.write(orjson.dumps({
+                            'id': embedding_id,
+                            'doc': page['documents'][i],
+                            'meta': page['metadatas'][i] or {},
+                            'emb': base64.b64encode(embeddings[i].tobytes()).decode('ascii')
+                        }) + b'\n')
             
-            logger.info(f"Exported {export_data['total_count']} embeddings to {output_path}")
+            logger.info(f"Exported {total_count} embeddings to {output_path}")
             return True
             
         except Exception as e:
@@ -444,41 +1011,73 @@ class RAGPipeline:
             return False
     
     async def import_embeddings(self, input_path: str) -> bool:
-        """Import embeddings from JSON file"""
+        """Import embeddings from a JSONL file written by export_embeddings"""
         try:
-            with open(input_path, 'r', encoding='utf-8') as f:
-                import_data = json.load(f)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._import_embeddings_file, input_path)
             
-            data = import_data['data']
-            
-            if data['ids'] and data['documents']:
-                self.collection.add(
-                    ids=data['ids'],
-                    documents=data['documents'],
-                    metadatas=data['metadatas'] if data['metadatas'] else [{}] * len(data['ids']),
-                    embeddings=data['embeddings'] if data['embeddings'] else None
-                )
-                
-                logger.info(f"Imported {len(data['ids'])} embeddings from {input_path}")
-                return True
-            else:
-                logger.warning("No data to import")
-                return False
-                
         except Exception as e:
             logger.error(f"Import failed: {e}")
             return False
     
+    def _import_embeddings_file(self, input_path: str) -> bool:
+        """Add an export file's rows in chunks across a thread pool, bounding chunks in flight"""
+        max_workers = os.cpu_count() or 1
+        imported = 0
+        pending = set()
+        
+        with open(input_path, 'rb') as f, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            header = orjson.loads(f.readline())
+            for lines in iter(lambda: list(islice(f, IMPORT_CHUNK_SIZE)), []):
+                pending.add(executor.submit(
+                    self._add_exported_rows, lines, header.get('embedding_dtype', 'float32')
+                ))
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    imported += sum(future.result() for future in done)
+            imported += sum(future.result() for future in pending)
+        
+        if not imported:
+            logger.warning("No data to import")
+            return False
+        
+        logger.info(f"Imported {imported} embeddings from {input_path} ({header.get('collection_name')})")
+        return True
+    
+    def _add_exported_rows(self, lines: List[bytes], embedding_dtype: str = "float32") -> int:
+        """Decode a chunk of exported JSONL rows and add them to the collection"""
+        rows = [orjson.loads(line) for line in lines if line.strip()]
+        if not rows:
+            return 0
+        
+        # One buffer for the whole chunk instead of an array per row
+        embeddings = _dequantize(np.frombuffer(
+            b''.join(base64.b64decode(row['emb']) for row in rows),
+            dtype=embedding_dtype
+        ).reshape(len(rows), -1))
+        
+        self.collection.add(
+            ids=[row['id'] for row in rows],
+            documents=[row['doc'] for row in rows],
+            metadatas=[row['meta'] or None for row in rows],
+            embeddings=embeddings
+        )
+        self._update_stats(added=[row['meta'] or {} for row in rows])
+        return len(rows)
+    
     def reset_collection(self):
         """Reset the entire collection (use with caution!)"""
         try:
+            hnsw_params = self.configure_hnsw_params()
             self.client.delete_collection(name=self.collection_name)
-            self.collection = self._get_or_create_collection()
+            self.collection = self._get_or_create_collection(hnsw_params)
+            self.rebuild_stats()
             logger.warning(f"Reset collection: {self.collection_name}")
             
         except Exception as e:
             logger.error(f"Failed to reset collection: {e}")
 
-# Global RAG pipeline instance
-rag_pipeline = RAGPipeline()
-
+@lru_cache(maxsize=1)
+def get_rag_pipeline() -> RAGPipeline:
+    """Shared pipeline, built on first use so importers don't pay for loading the model"""
+    return RAGPipeline()
@@ -3,13 +3,42 @@ Summarizer chain for email classification and inbox summarization
 """
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta
-import json
+from collections import Counter
+import re
 import logging
 
 from .llm_adapter import LLMAdapter
 from .db import Email, EmailCategory
 from .utils import format_email_for_llm, logger
 
+# Unambiguous markers that settle a category without asking the LLM
+FAST_CLASSIFICATION_RULES = [
+    ("Rejection", r"not (?:to )?(?:move|moving) forward|decided to (?:pursue|proceed with|move forward with) other|other candidates|position has been filled|not been selected"),
+    ("Offer", r"pleased to offer|offer letter|extend (?:you )?an offer"),
+    ("Interview", r"interview (?:invitation|confirmation|scheduled)|schedule (?:an|your) interview|invite you to (?:an )?interview"),
+    ("Application Sent", r"your application (?:to|for|has been)|application (?:received|submitted)|thank(?:s| you) for applying"),
+    ("Other", r"unsubscribe|newsletter|job alert"),
+]
+
+# One alternation with a named group per category, scanned in a single pass
+FAST_CLASSIFICATION_PATTERN = re.compile(
+    '|'.join(f"(?P<rule{i}>{pattern})" for i, (_, pattern) in enumerate(FAST_CLASSIFICATION_RULES)),
+    re.IGNORECASE
+)
+
+CLASSIFICATION_SCHEMA = {
+    "category": "string",
+    "confidence": "number",
+    "summary": "string",
+    "key_info": "object"
+}
+
+# Per-email block of the inbox summary prompt, filled positionally with %
+INBOX_EMAIL_TEMPLATE = "Date: %s\nCategory: %s\nFrom: %s\nSubject: %s\nSummary: %s"
+
+# Emails in flight per batch_classify_emails call (see its docstring)
+BATCH_CLASSIFY_CONCURRENCY = 16
+
 class SummarizerChain:
     """Chain pipeline for email classification and summarization"""
     
@@ -23,6 +52,10 @@ class SummarizerChain:
             "Rejection",
             "Other"
         ]
+        # Split the template once so each prompt is a plain concatenation
+        self._classify_prompt_head, self._classify_prompt_tail = (
+            self.get_classify_email_prompt().split('{email_content}')
+        )
     
     def get_classify_email_prompt(self) -> str:
         """Get the email classification prompt template"""
@@ -69,21 +102,18 @@ Keep the summary professional, encouraging, and actionable. Limit to 200-300 wor
 """
     
     async def classify_email(self, email_content: str) -> Dict[str, Any]:
-        """Classify a single email using LLM"""
+        """Classify a single email, using the LLM only when the rule pre-filter is not decisive"""
         try:
-            prompt = self.get_classify_email_prompt().format(
-                email_content=email_content[:2000]  # Limit content length
-            )
+            fast_result = self._fast_classify(email_content)
+            if fast_result:
+                return fast_result
+            
+            prompt = self._build_classify_prompt(email_content)
             
             # Get structured response
             result = await self.llm.generate_structured_response(
                 prompt=prompt,
-                schema={
-                    "category": "string",
-                    "confidence": "number", 
-                    "summary": "string",
-                    "key_info": "object"
-                },
+                schema=CLASSIFICATION_SCHEMA,
                 temperature=0.3
             )
             
@@ -116,48 +146,63 @@ Keep the summary professional, encouraging, and actionable. Limit to 200-300 wor
                 'error': True
             }
     
-    async def batch_classify_emails(self, emails: List[str]) -> List[Dict[str, Any]]:
-        """Classify multiple emails in batch"""
-        try:
-            # Prepare prompts
-            prompts = []
-            for email_content in emails:
-                prompt = self.get_classify_email_prompt().format(
-                    email_content=email_content[:2000]
-                )
-                prompts.append(prompt)
-            
-            # Process in batch
-            results = await self.llm.batch_process(prompts, max_concurrent=3)
-            
-            # Parse results
-            classifications = []
-            for i, result in enumerate(results):
-                try:
-                    # Try to parse as JSON
-                    if result.startswith('{'):
-                        parsed = json.loads(result)
-                        classifications.append(self._validate_classification(parsed))
-                    else:
-                        # Fallback parsing
-                        classifications.append(self._parse_fallback_result(result))
-                except Exception as e:
-                    logger.warning(f"Failed to parse batch result {i}: {e}")
-                    classifications.append({
-                        'category': 'Other',
-                        'confidence': 0.0,
-                        'summary': 'Parsing error',
-                        'key_info': {},
-                        'error': True
-                    })
-            
-            return classifications
-            
-        except Exception as e:
-            logger.error(f"Batch classification failed: {e}")
-            return [{'category': 'Other', 'confidence': 0.0, 'summary': 'Batch error', 'key_info': {}, 'error': True}] * len(emails)
+    async def batch_classify_emails(self,
+                                    emails: List[str],
+                                    max_concurrent: int = BATCH_CLASSIFY_CONCURRENCY) -> List[Dict[str, Any]]:
+        """
+        Classify multiple emails concurrently
+        Emails the rule pre-filter settles never reach the LLM; the rest go through one
+        batch_structured_response call, where max_concurrent bounds this batch's requests
+        and OLLAMA_MAX_INFLIGHT (matching the server's OLLAMA_NUM_PARALLEL) caps them adapter-wide
+        """
+        processed_at = datetime.now().isoformat()  # One timestamp for the whole batch
+        classifications = [self._fast_classify(email_content, processed_at) for email_content in emails]
+        pending = [i for i, result in enumerate(classifications) if result is None]
+        
+        results = await self.llm.batch_structured_response(
+            [self._build_classify_prompt(emails[i]) for i in pending],
+            schema=CLASSIFICATION_SCHEMA,
+            max_concurrent=max_concurrent,
+            temperature=0.3
+        )
+        
+        for i, result in zip(pending, results):
+            try:
+                classifications[i] = self._validate_classification(result, processed_at)
+            except Exception as e:
+                logger.warning(f"Failed to classify batch email {i}: {e}")
+                classifications[i] = {
+                    'category': 'Other',
+                    'confidence': 0.0,
+                    'summary': 'Parsing error',
+                    'key_info': {},
+                    'error': True
+                }
+        return classifications
+    
+    def _build_classify_prompt(self, email_content: str) -> str:
+        """Fill the classification template with the (length-limited) email content"""
+        return self._classify_prompt_head + email_content[:2000] + self._classify_prompt_tail
     
-    def _validate_classification(self, result: Dict[str, Any]) -> Dict[str, Any]:
+    def _fast_classify(self, email_content: str, processed_at: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Classify from unambiguous markers; None if no rule or several categories match"""
+        matched = {
+            FAST_CLASSIFICATION_RULES[int(match.lastgroup[4:])][0]
+            for match in FAST_CLASSIFICATION_PATTERN.finditer(email_content)
+        }
+        if len(matched) != 1:
+            return None
+        
+        return {
+            'category': matched.pop(),
+            'confidence': 0.95,
+            'summary': email_content.strip()[:120],
+            'key_info': {},
+            'processed_at': processed_at or datetime.now().isoformat(),
+            'rule_based': True
+        }
+    
+    def _validate_classification(self, result: Dict[str, Any], processed_at: Optional[str] = None) -> Dict[str, Any]:
         """Validate and clean classification result"""
         category = result.get('category', 'Other')
         if category not in self.classification_categories:
@@ -171,59 +216,30 @@ Keep the summary professional, encouraging, and actionable. Limit to 200-300 wor
             'confidence': confidence,
             'summary': result.get('summary', 'No summary')[:200],
             'key_info': result.get('key_info', {}),
-            'processed_at': datetime.now().isoformat()
-        }
-    
-    def _parse_fallback_result(self, result: str) -> Dict[str, Any]:
-        """Fallback parsing for non-JSON results"""
-        # Simple keyword-based classification
-        result_lower = result.lower()
-        
-        category = 'Other'
-        confidence = 0.3
-        
-        if any(word in result_lower for word in ['application', 'applied', 'applying']):
-            category = 'Application Sent'
-        elif any(word in result_lower for word in ['recruiter', 'hr', 'hiring']):
-            category = 'Recruiter Response'
-        elif any(word in result_lower for word in ['interview', 'meeting', 'call']):
-            category = 'Interview'
-        elif any(word in result_lower for word in ['offer', 'congratulations', 'pleased to offer']):
-            category = 'Offer'
-        elif any(word in result_lower for word in ['reject', 'unfortunately', 'not selected']):
-            category = 'Rejection'
-        
-        return {
-            'category': category,
-            'confidence': confidence,
-            'summary': result[:100],
-            'key_info': {},
-            'fallback_parsed': True
+            'processed_at': processed_at or datetime.now().isoformat()
         }
     
     async def generate_inbox_summary(self, emails: List[Email]) -> str:
         """Generate comprehensive inbox summary"""
         try:
-            # Prepare email summaries
-            email_summaries = []
-            for email in emails:
-                email_summary = f"""
-Date: {email.date_received.strftime('%Y-%m-%d') if email.date_received else 'Unknown'}
-Category: {email.category}
-From: {email.sender}
-Subject: {email.subject}
-Summary: {email.summary or 'No summary'}
-"""
-                email_summaries.append(email_summary.strip())
+            # Prepare email summaries (only the 20 most recent are sent)
+            email_summaries = [
+                INBOX_EMAIL_TEMPLATE % (
+                    email.date_received.date().isoformat() if email.date_received else 'Unknown',
+                    email.category,
+                    email.sender,
+                    email.subject,
+                    email.summary or 'No summary'
+                )
+                for email in emails[:20]
+            ]
             
-            # Calculate pipeline stats
-            pipeline_stats = {}
-            for category in self.classification_categories:
-                count = sum(1 for email in emails if email.category == category)
-                pipeline_stats[category] = count
+            # Calculate pipeline stats in a single pass
+            category_counts = Counter(email.category for email in emails)
+            pipeline_stats = {category: category_counts[category] for category in self.classification_categories}
             
             # Format the data for the prompt
-            email_summaries_text = "\n\n".join(email_summaries[:20])  # Limit to 20 most recent
+            email_summaries_text = "\n\n".join(email_summaries)
             pipeline_stats_text = "\n".join([f"- {category}: {count}" for category, count in pipeline_stats.items()])
             
             prompt = self.get_summarize_inbox_prompt().format(
@@ -246,22 +262,23 @@ Summary: {email.summary or 'No summary'}
     async def analyze_job_progress(self, emails: List[Email], days: int = 30) -> Dict[str, Any]:
         """Analyze job search progress over time"""
         try:
-            # Filter emails by date range
+            # Filter by date range and calculate metrics in a single pass
             cutoff_date = datetime.now() - timedelta(days=days)
-            recent_emails = [email for email in emails if email.date_received and email.date_received >= cutoff_date]
-            
-            # Calculate metrics
-            total_emails = len(recent_emails)
-            categories_count = {}
+            total_emails = 0
+            categories_count = Counter()
             companies = set()
             
-            for email in recent_emails:
-                category = email.category
-                categories_count[category] = categories_count.get(category, 0) + 1
+            for email in emails:
+                if not email.date_received or email.date_received < cutoff_date:
+                    continue
+                
+                total_emails += 1
+                categories_count[email.category] += 1
                 
                 # Extract company info
-                if hasattr(email, 'company') and email.company:
-                    companies.add(email.company)
+                company = getattr(email, 'company', None)
+                if company:
+                    companies.add(company)
             
             # Calculate conversion rates
             applications = categories_count.get('Application Sent', 0)
@@ -277,7 +294,7 @@ Summary: {email.summary or 'No summary'}
             return {
                 'period_days': days,
                 'total_emails': total_emails,
-                'categories': categories_count,
+                'categories': dict(categories_count),
                 'unique_companies': len(companies),
                 'metrics': {
                     'applications_sent': applications,
@@ -307,42 +324,51 @@ Summary: {email.summary or 'No summary'}
         try:
             suggestions = []
             now = datetime.now()
+            follow_up_before = now - timedelta(days=7)
+            thank_you_before = now - timedelta(days=3)
+            respond_before = now - timedelta(days=2)
+            
+            # Latest email per sender, so reply checks are lookups instead of rescans
+            latest_by_sender = {}
+            for e in emails:
+                if e.date_received and (e.sender not in latest_by_sender or e.date_received > latest_by_sender[e.sender]):
+                    latest_by_sender[e.sender] = e.date_received
             
             for email in emails:
-                if not email.date_received:
+                received = email.date_received
+                if not received:
                     continue
                 
-                days_ago = (now - email.date_received).days
-                
                 # Follow-up suggestions based on category and timing
-                if email.category == 'Application Sent' and days_ago >= 7:
-                    if not any(e.sender == email.recipient and e.date_received > email.date_received for e in emails):
+                if email.category == 'Application Sent' and received <= follow_up_before:
+                    latest_reply = latest_by_sender.get(email.recipient)
+                    if not latest_reply or latest_reply <= received:
                         suggestions.append({
                             'type': 'follow_up',
                             'priority': 'medium',
                             'action': f'Follow up on application to {email.sender}',
                             'email_subject': email.subject,
-                            'days_since': days_ago,
+                            'days_since': (now - received).days,
                             'reasoning': 'No response received after 1 week'
                         })
                 
-                elif email.category == 'Interview' and days_ago >= 3:
+                elif email.category == 'Interview' and received <= thank_you_before:
                     suggestions.append({
                         'type': 'thank_you',
                         'priority': 'high',
                         'action': f'Send thank you note for interview with {email.sender}',
                         'email_subject': email.subject,
-                        'days_since': days_ago,
+                        'days_since': (now - received).days,
                         'reasoning': 'Interview follow-up is overdue'
                     })
                 
-                elif email.category == 'Recruiter Response' and days_ago >= 2:
+                elif email.category == 'Recruiter Response' and received <= respond_before:
                     suggestions.append({
                         'type': 'response',
                         'priority': 'high',
                         'action': f'Respond to recruiter {email.sender}',
                         'email_subject': email.subject,
-                        'days_since': days_ago,
+                        'days_since': (now - received).days,
                         'reasoning': 'Recruiter response requires timely reply'
                     })
             
@@ -4,8 +4,11 @@ Utility functions for InSightMail
 import re
 import json
 import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import islice
 from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Tuple, Union
 from email.utils import parseaddr, parsedate_to_datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -15,35 +18,58 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def clean_email_content(content: str) -> str:
-    """Clean and normalize email content"""
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Email signatures (common patterns). Every alternative strips from its start to the end,
+# so cutting at the earliest match is one scan with the same result as a sub per pattern
+SIGNATURE_PATTERN = re.compile('|'.join((
+    r'--\s*\n.*',  # Standard email signature
+    r'Sent from my.*',  # Mobile signatures
+    r'Best regards.*',  # Common sign-offs
+    r'Thanks.*\n.*\n.*@.*',  # Email with signature
+)), re.IGNORECASE | re.DOTALL)
+
+def clean_email_content(content: str, max_length: Optional[int] = None) -> str:
+    """
+    Clean and normalize email content
+    Callers that only need a prefix pass max_length so the regexes skip the discarded tail
+    """
     if not content:
         return ""
     
-    # Remove excessive whitespace
-    content = re.sub(r'\s+', ' ', content)
+    if max_length is not None and len(content) > max_length:
+        content = content[:max_length]
     
-    # Remove email signatures (common patterns)
-    signature_patterns = [
-        r'--\s*\n.*',  # Standard email signature
-        r'Sent from my.*',  # Mobile signatures
-        r'Best regards.*',  # Common sign-offs
-        r'Thanks.*\n.*\n.*@.*',  # Email with signature
-    ]
+    # Remove excessive whitespace
+    content = WHITESPACE_PATTERN.sub(' ', content)
     
-    for pattern in signature_patterns:
-        content = re.sub(pattern, '', content, flags=re.IGNORECASE | re.DOTALL)
+    # Remove email signatures
+    signature = SIGNATURE_PATTERN.search(content)
+    if signature:
+        content = content[:signature.start()]
     
     return content.strip()
 
+# Senders repeat heavily across an inbox, so address parsing is memoized
+SENDER_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=SENDER_CACHE_SIZE)
+def _parse_sender(sender: str) -> Tuple[str, str]:
+    """Cached (name, email) parse of a sender string"""
+    name, email = parseaddr(sender)
+    return (name.strip() if name else "", email.strip().lower() if email else "")
+
 def extract_sender_info(sender: str) -> Dict[str, str]:
     """Extract name and email from sender string"""
-    name, email = parseaddr(sender)
+    name, email = _parse_sender(sender)
     return {
-        "name": name.strip() if name else "",
-        "email": email.strip().lower() if email else ""
+        "name": name,
+        "email": email
     }
 
+DOMAIN_SUFFIX_PATTERN = re.compile(r'\.(com|org|net|edu|gov)$')
+
+@lru_cache(maxsize=SENDER_CACHE_SIZE)
 def extract_company_from_email(email_address: str) -> str:
     """Extract company name from email domain"""
     if not email_address or '@' not in email_address:
@@ -52,7 +78,7 @@ def extract_company_from_email(email_address: str) -> str:
     domain = email_address.split('@')[1].lower()
     
     # Remove common domain suffixes
-    domain = re.sub(r'\.(com|org|net|edu|gov)$', '', domain)
+    domain = DOMAIN_SUFFIX_PATTERN.sub('', domain)
     
     # Handle common patterns
     if domain.startswith('mail.'):
@@ -60,21 +86,28 @@ def extract_company_from_email(email_address: str) -> str:
     
     return domain.replace('.', ' ').title()
 
+JOB_KEYWORDS = [
+    'application', 'interview', 'position', 'job', 'career', 'opportunity',
+    'recruiter', 'hiring', 'candidate', 'resume', 'cv', 'offer',
+    'rejection', 'thank you for applying', 'next steps', 'screening'
+]
+
+# One precompiled alternation: a single C-level scan instead of a Python loop per keyword
+JOB_KEYWORDS_PATTERN = re.compile('|'.join(map(re.escape, JOB_KEYWORDS)), re.IGNORECASE)
+
 def is_job_related_email(subject: str, sender: str, content: str) -> bool:
     """Quick heuristic to identify potentially job-related emails"""
-    job_keywords = [
-        'application', 'interview', 'position', 'job', 'career', 'opportunity',
-        'recruiter', 'hiring', 'candidate', 'resume', 'cv', 'offer',
-        'rejection', 'thank you for applying', 'next steps', 'screening'
-    ]
-    
-    text_content = f"{subject} {sender} {content}".lower()
-    
-    return any(keyword in text_content for keyword in job_keywords)
+    return JOB_KEYWORDS_PATTERN.search(f"{subject} {sender} {content}") is not None
 
-def generate_content_hash(content: str) -> str:
-    """Generate a hash for content deduplication"""
-    return hashlib.md5(content.encode('utf-8')).hexdigest()
+def generate_content_hash(content: Union[str, bytes]) -> str:
+    """Generate a hash for content deduplication (str or raw bytes)"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+def cache_key(*parts: str) -> str:
+    """Build a compact cache key from content parts (e.g. model name and prompt)"""
+    return hashlib.blake2b('\0'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
 
 def parse_gmail_date(date_str: str) -> Optional[datetime]:
     """Parse Gmail date string to datetime object"""
@@ -91,13 +124,24 @@ def parse_gmail_date(date_str: str) -> Optional[datetime]:
         logger.warning(f"Could not parse date '{date_str}': {e}")
         return None
 
+INVALID_FILENAME_CHARS_PATTERN = re.compile(r'[<>:"/\\|?*]')
+
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename for safe file system operations"""
     # Remove or replace invalid characters
-    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    filename = INVALID_FILENAME_CHARS_PATTERN.sub('_', filename)
     filename = filename.strip('. ')  # Remove leading/trailing dots and spaces
     return filename[:255]  # Limit length
 
+# Lowercased header name -> metadata key
+METADATA_HEADERS = {
+    'subject': 'subject',
+    'from': 'sender',
+    'to': 'recipient',
+    'date': 'date',
+    'message-id': 'message_id',
+}
+
 def extract_email_metadata(email_data: Dict[str, Any]) -> Dict[str, Any]:
     """Extract and normalize metadata from email data"""
     metadata = {
@@ -106,71 +150,71 @@ def extract_email_metadata(email_data: Dict[str, Any]) -> Dict[str, Any]:
         'labels': email_data.get('labelIds', []),
         'snippet': email_data.get('snippet', ''),
         'size_estimate': email_data.get('sizeEstimate', 0),
+        **dict.fromkeys(METADATA_HEADERS.values(), ''),
     }
     
-    # Extract headers
-    headers = {}
+    # Scan headers only until every wanted one has been found
+    remaining = len(METADATA_HEADERS)
     payload = email_data.get('payload', {})
     for header in payload.get('headers', []):
-        headers[header['name'].lower()] = header['value']
-    
-    metadata.update({
-        'subject': headers.get('subject', ''),
-        'sender': headers.get('from', ''),
-        'recipient': headers.get('to', ''),
-        'date': headers.get('date', ''),
-        'message_id': headers.get('message-id', ''),
-    })
+        key = METADATA_HEADERS.get(header['name'].lower())
+        if key and not metadata[key] and header['value']:
+            metadata[key] = header['value']
+            remaining -= 1
+            if not remaining:
+                break
     
     return metadata
 
+# Built once and filled positionally; no leading newline, so only trailing whitespace needs trimming
+EMAIL_FOR_LLM_TEMPLATE = "Subject: %s\nFrom: %s\nTo: %s\nDate: %s\n\nContent:\n%s"
+
 def format_email_for_llm(email: Dict[str, Any]) -> str:
     """Format email data for LLM processing"""
-    template = """
-Subject: {subject}
-From: {sender}
-To: {recipient}
-Date: {date}
-
-Content:
-{content}
-"""
-    
-    return template.format(
-        subject=email.get('subject', 'No Subject'),
-        sender=email.get('sender', 'Unknown'),
-        recipient=email.get('recipient', 'Unknown'),
-        date=email.get('date', 'Unknown'),
-        content=email.get('snippet', '')[:500]  # Limit content length
-    ).strip()
+    get = email.get
+    return (EMAIL_FOR_LLM_TEMPLATE % (
+        get('subject', 'No Subject'),
+        get('sender', 'Unknown'),
+        get('recipient', 'Unknown'),
+        get('date', 'Unknown'),
+        get('snippet', '')[:500]  # Limit content length
+    )).rstrip()
 
 def create_embedding_id(email_id: str, account: str) -> str:
     """Create unique embedding ID for vector store"""
     return f"{account}_{email_id}"
 
+EMAIL_ADDRESS_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
 def validate_email_address(email: str) -> bool:
     """Validate email address format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return bool(re.match(pattern, email))
+    return bool(EMAIL_ADDRESS_PATTERN.match(email))
+
+# One character class (the old per-character alternation spelled out): letters, digits,
+# and the ASCII punctuation URLs carry, including '%' so percent-escapes need no branch
+URL_PATTERN = re.compile(r"https?://[A-Za-z0-9!$%&'()*+,\-./:;<=>?@\[\\\]^_]+")
 
 def extract_urls_from_content(content: str) -> List[str]:
     """Extract URLs from email content"""
-    url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    return re.findall(url_pattern, content)
+    return URL_PATTERN.findall(content)
+
+# Single alternation so anonymization is one scan; the matching group picks the token
+ANONYMIZE_PATTERN = re.compile(
+    r'(?P<email>\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b)'
+    r'|(?P<phone>\b\d{3}-\d{3}-\d{4}\b)'
+    r'|(?P<phone_paren>\(\d{3}\)\s*\d{3}-\d{4}\b)'
+    r'|(?P<ssn>\b\d{3}-\d{2}-\d{4}\b)'
+)
+ANONYMIZE_TOKENS = {
+    'email': '[EMAIL]',
+    'phone': '[PHONE]',
+    'phone_paren': '[PHONE]',
+    'ssn': '[SSN]',
+}
 
 def anonymize_email_content(content: str) -> str:
     """Anonymize sensitive information in email content"""
-    # Replace email addresses
-    content = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', '[EMAIL]', content)
-    
-    # Replace phone numbers
-    content = re.sub(r'\b\d{3}-\d{3}-\d{4}\b', '[PHONE]', content)
-    content = re.sub(r'\b\(\d{3}\)\s*\d{3}-\d{4}\b', '[PHONE]', content)
-    
-    # Replace potential SSNs
-    content = re.sub(r'\b\d{3}-\d{2}-\d{4}\b', '[SSN]', content)
-    
-    return content
+    return ANONYMIZE_PATTERN.sub(lambda match: ANONYMIZE_TOKENS[match.lastgroup], content)
 
 def calculate_similarity_score(text1: str, text2: str) -> float:
     """Calculate simple similarity score between two texts"""
@@ -182,56 +226,92 @@ def calculate_similarity_score(text1: str, text2: str) -> float:
     if not words1 or not words2:
         return 0.0
     
-    intersection = words1.intersection(words2)
-    union = words1.union(words2)
+    # Count the overlap without materializing intersection/union sets
+    if len(words1) > len(words2):
+        words1, words2 = words2, words1
+    overlap = sum(1 for word in words1 if word in words2)
     
-    return len(intersection) / len(union)
+    return overlap / (len(words1) + len(words2) - overlap)
+
+# Subject keyword weights, matched in a single scan (each keyword counts once)
+PRIORITY_KEYWORD_SCORES = {
+    # High priority keywords
+    'offer': 10, 'interview': 10, 'urgent': 10, 'immediate': 10,
+    # Medium priority keywords
+    'application': 5, 'position': 5, 'opportunity': 5, 'recruiter': 5,
+}
+PRIORITY_KEYWORDS_PATTERN = re.compile('|'.join(map(re.escape, PRIORITY_KEYWORD_SCORES)))
+NOREPLY_SENDER_PATTERN = re.compile(r'no-?reply')
+RECRUITING_SENDER_PATTERN = re.compile(r'hr|recruiter|talent')
+NOREPLY_SENDER_SCORE = -3
+RECRUITING_SENDER_SCORE = 7
 
 def get_email_priority_score(email_data: Dict[str, Any]) -> int:
     """Calculate priority score for email processing (higher = more important)"""
-    score = 0
-    
     subject = email_data.get('subject', '').lower()
     sender = email_data.get('sender', '').lower()
     
-    # High priority keywords
-    high_priority = ['offer', 'interview', 'urgent', 'immediate']
-    medium_priority = ['application', 'position', 'opportunity', 'recruiter']
-    
-    for keyword in high_priority:
-        if keyword in subject:
-            score += 10
-    
-    for keyword in medium_priority:
-        if keyword in subject:
-            score += 5
+    score = sum(PRIORITY_KEYWORD_SCORES[keyword] for keyword in set(PRIORITY_KEYWORDS_PATTERN.findall(subject)))
     
     # Sender-based scoring
-    if 'noreply' in sender or 'no-reply' in sender:
-        score -= 3
+    if NOREPLY_SENDER_PATTERN.search(sender):
+        score += NOREPLY_SENDER_SCORE
     
-    if any(word in sender for word in ['hr', 'recruiter', 'talent']):
-        score += 7
+    if RECRUITING_SENDER_PATTERN.search(sender):
+        score += RECRUITING_SENDER_SCORE
     
     return max(0, score)
 
+class LRUCache:
+    """Small in-process least-recently-used cache"""
+    
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+    
+    def get(self, key: str) -> Any:
+        """Return the cached value (or None) and mark it recently used"""
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+    
+    def set(self, key: str, value: Any):
+        """Store a value, evicting the least recently used entry when full"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
 class EmailProcessor:
     """Utility class for email processing operations"""
     
     def __init__(self):
+        # 64-bit fingerprints instead of ID strings: roughly half the memory,
+        # with collision odds (~n^2 / 2^65) far below any real inbox size
         self.processed_emails = set()
     
+    @staticmethod
+    def _fingerprint(email_id: str) -> int:
+        """Compact 64-bit fingerprint of an email ID"""
+        return int.from_bytes(hashlib.blake2b(email_id.encode('utf-8'), digest_size=8).digest(), 'little')
+    
     def is_duplicate(self, email_id: str) -> bool:
         """Check if email has already been processed"""
-        return email_id in self.processed_emails
+        return self._fingerprint(email_id) in self.processed_emails
     
     def mark_processed(self, email_id: str):
         """Mark email as processed"""
-        self.processed_emails.add(email_id)
+        self.processed_emails.add(self._fingerprint(email_id))
     
-    def batch_process_emails(self, emails: List[Dict[str, Any]], batch_size: int = 10) -> List[List[Dict[str, Any]]]:
-        """Split emails into batches for processing"""
-        return [emails[i:i + batch_size] for i in range(0, len(emails), batch_size)]
+    def batch_process_emails(self, emails: Iterable[Dict[str, Any]], batch_size: int = 10) -> Iterator[List[Dict[str, Any]]]:
+        """Lazily split emails (any iterable) into batches, holding one batch at a time"""
+        emails = iter(emails)
+        while batch := list(islice(emails, batch_size)):
+            yield batch
 
 # Global email processor instance
 email_processor = EmailProcessor()
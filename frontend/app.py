@@ -2,15 +2,17 @@
 InSightMail Streamlit Dashboard
 """
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import requests
+from requests.adapters import HTTPAdapter
 import json
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # Add backend to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
@@ -93,14 +95,30 @@ st.markdown("""
 # API Configuration
 API_BASE_URL = "http://localhost:8000"
 
+# Seconds a dashboard GET is reused across Streamlit reruns
+API_CACHE_TTL = 30
+
+# Seconds before a GET to the API is abandoned
+API_TIMEOUT = 5
+
+# Only the email fields the recent-activity list renders are requested
+DASHBOARD_EMAIL_FIELDS = "subject,sender,category,date_received,confidence_score"
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Keep-alive session shared by every rerun and session, so calls reuse pooled connections"""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return session
+
 class APIClient:
     """Client for communicating with FastAPI backend"""
     
     @staticmethod
-    def get(endpoint: str, params: Optional[Dict] = None) -> Dict:
+    def get(endpoint: str, params: Optional[Dict] = None, timeout: float = API_TIMEOUT) -> Dict:
         """GET request to API"""
         try:
-            response = requests.get(f"{API_BASE_URL}{endpoint}", params=params)
+            response = get_session().get(f"{API_BASE_URL}{endpoint}", params=params, timeout=timeout)
             return response.json() if response.status_code == 200 else {"error": f"HTTP {response.status_code}"}
         except Exception as e:
             return {"error": str(e)}
@@ -110,20 +128,48 @@ class APIClient:
         """POST request to API"""
         try:
             if files:
-                response = requests.post(f"{API_BASE_URL}{endpoint}", data=data, files=files)
+                response = get_session().post(f"{API_BASE_URL}{endpoint}", data=data, files=files)
             else:
-                response = requests.post(f"{API_BASE_URL}{endpoint}", json=data)
+                response = get_session().post(f"{API_BASE_URL}{endpoint}", json=data)
             return response.json() if response.status_code == 200 else {"error": f"HTTP {response.status_code}"}
         except Exception as e:
             return {"error": str(e)}
 
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
+def _cached_get(endpoint: str, params: Optional[Dict] = None) -> Dict:
+    """GET through the Streamlit cache; raising keeps failures out of it"""
+    result = APIClient.get(endpoint, params)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+def cached_get(endpoint: str, params: Optional[Dict] = None) -> Dict:
+    """GET request to API, reused for API_CACHE_TTL seconds across reruns"""
+    try:
+        return _cached_get(endpoint, params)
+    except RuntimeError as e:
+        return {"error": str(e)}
+
+@lru_cache(maxsize=None)
+def category_css_class(category: str) -> str:
+    """CSS class for a category badge (e.g. "Application Sent" -> "category-applicationsent")"""
+    return f"category-{category.lower().replace(' ', '')}"
+
+def fetch_dashboard_bundle(limit: int = 10) -> Dict:
+    """Stats, recent emails and health for the dashboard in one request"""
+    bundle = cached_get("/dashboard", params={'limit': limit})
+    if "error" not in bundle:
+        return bundle
+    
+    # Backends without /dashboard: fetch the three parts concurrently instead
+    requests_to_send = [("/stats", None), ("/emails", {'limit': limit, 'fields': DASHBOARD_EMAIL_FIELDS}), ("/health", None)]
+    with ThreadPoolExecutor(max_workers=len(requests_to_send)) as pool:
+        stats, emails, health = pool.map(lambda request: APIClient.get(*request), requests_to_send)
+    return {"stats": stats, "emails": emails, "health": health}
+
 def check_api_health() -> bool:
     """Check if API is running"""
-    try:
-        response = requests.get(f"{API_BASE_URL}/health", timeout=5)
-        return response.status_code == 200
-    except:
-        return False
+    return "error" not in cached_get("/health")
 
 def main():
     """Main application"""
@@ -160,12 +206,44 @@ def main():
     elif page == "Analytics":
         render_analytics()
 
+# Reruns only the decorated block on its own widget events (Streamlit >= 1.33); a no-op on older versions
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+# Chart figures are cached on their data, so reruns with unchanged stats skip rebuilding them
+@st.cache_data(show_spinner=False)
+def build_category_pie(stats_items: Tuple[Tuple[str, int], ...]) -> go.Figure:
+    """Pie chart of email counts per category"""
+    fig = px.pie(
+        values=[count for _, count in stats_items],
+        names=[category for category, _ in stats_items],
+        color_discrete_sequence=px.colors.qualitative.Set3
+    )
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    return fig
+
+@st.cache_data(show_spinner=False)
+def build_funnel(funnel_items: Tuple[Tuple[str, int], ...]) -> go.Figure:
+    """Job search funnel from (stage, count) pairs"""
+    fig = go.Figure(go.Funnel(
+        y=[stage for stage, _ in funnel_items],
+        x=[count for _, count in funnel_items],
+        textinfo="value+percent initial"
+    ))
+    fig.update_layout(height=400)
+    return fig
+
 def render_dashboard():
     """Render main dashboard"""
     st.header("📊 Dashboard Overview")
     
-    # Get stats from API
-    stats = APIClient.get("/stats")
+    # Responses are cached for API_CACHE_TTL seconds; refresh forces a refetch
+    if st.button("🔄 Refresh"):
+        st.cache_data.clear()
+        st.rerun()
+    
+    # Get stats, recent emails and health from API in one call
+    bundle = fetch_dashboard_bundle()
+    stats = bundle["stats"]
     if "error" in stats:
         st.error(f"Failed to load stats: {stats['error']}")
         return
@@ -198,54 +276,44 @@ def render_dashboard():
         st.subheader("Email Categories")
         if pipeline_stats:
             # Pie chart
-            fig = px.pie(
-                values=list(pipeline_stats.values()),
-                names=list(pipeline_stats.keys()),
-                color_discrete_sequence=px.colors.qualitative.Set3
-            )
-            fig.update_traces(textposition='inside', textinfo='percent+label')
+            fig = build_category_pie(tuple(pipeline_stats.items()))
             st.plotly_chart(fig, use_container_width=True)
     
     with col2:
         st.subheader("Job Search Funnel")
         if pipeline_stats:
             # Funnel chart
-            funnel_data = {
-                'Applications': pipeline_stats.get('Application Sent', 0),
-                'Responses': pipeline_stats.get('Recruiter Response', 0),
-                'Interviews': pipeline_stats.get('Interview', 0),
-                'Offers': pipeline_stats.get('Offer', 0)
-            }
-            
-            fig = go.Figure(go.Funnel(
-                y=list(funnel_data.keys()),
-                x=list(funnel_data.values()),
-                textinfo="value+percent initial"
-            ))
-            fig.update_layout(height=400)
+            funnel_data = (
+                ('Applications', pipeline_stats.get('Application Sent', 0)),
+                ('Responses', pipeline_stats.get('Recruiter Response', 0)),
+                ('Interviews', pipeline_stats.get('Interview', 0)),
+                ('Offers', pipeline_stats.get('Offer', 0))
+            )
+            fig = build_funnel(funnel_data)
             st.plotly_chart(fig, use_container_width=True)
     
     # Recent activity
     st.subheader("📧 Recent Activity")
     
-    # Get recent emails
-    emails = APIClient.get("/emails", params={'limit': 10})
+    # Recent emails
+    emails = bundle["emails"]
     if "error" not in emails and emails.get('emails'):
-        df = pd.DataFrame(emails['emails'])
-        
-        for _, email in df.iterrows():
+        # The payload is already a list of dicts; no DataFrame needed to walk it
+        for email in emails['emails']:
             with st.container():
                 col1, col2, col3 = st.columns([3, 2, 1])
                 
                 with col1:
-                    st.write(f"**{email['subject'][:60]}...**" if len(email['subject']) > 60 else f"**{email['subject']}**")
-                    st.write(f"From: {email['sender']}")
+                    subject = email.get('subject') or ''
+                    st.write(f"**{subject[:60]}...**" if len(subject) > 60 else f"**{subject}**")
+                    st.write(f"From: {email.get('sender')}")
                 
                 with col2:
-                    category = email['category']
-                    st.markdown(f'<span class="category-badge category-{category.lower().replace(" ", "")}">{category}</span>', 
+                    category = email.get('category') or 'Other'
+                    st.markdown(f'<span class="category-badge {category_css_class(category)}">{category}</span>', 
                               unsafe_allow_html=True)
-                    st.write(f"Date: {email['date_received'][:10] if email['date_received'] else 'Unknown'}")
+                    date_received = email.get('date_received')
+                    st.write(f"Date: {date_received[:10] if date_received else 'Unknown'}")
                 
                 with col3:
                     if email.get('confidence_score'):
@@ -255,29 +323,12 @@ def render_dashboard():
         st.info("No emails found. Upload some Gmail exports to get started!")
     
     # Quick actions
-    st.subheader("🚀 Quick Actions")
-    
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        if st.button("📤 Upload Emails", use_container_width=True):
-            st.session_state.current_page = "Email Upload"
-            st.rerun()
-    
-    with col2:
-        if st.button("🔍 Search Inbox", use_container_width=True):
-            st.session_state.current_page = "Ask My Inbox"
-            st.rerun()
-    
-    with col3:
-        if st.button("📈 View Analytics", use_container_width=True):
-            st.session_state.current_page = "Analytics"
-            st.rerun()
+    render_quick_actions()
     
     # System status
     st.subheader("🔧 System Status")
     
-    health = APIClient.get("/health")
+    health = bundle["health"]
     if "error" not in health:
         col1, col2, col3 = st.columns(3)
         
@@ -297,6 +348,28 @@ def render_dashboard():
     else:
         st.error("❌ API: Not responding")
 
+@fragment
+def render_quick_actions():
+    """Quick action buttons; a click reruns just this block before navigating"""
+    st.subheader("🚀 Quick Actions")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        if st.button("📤 Upload Emails", use_container_width=True):
+            st.session_state.current_page = "Email Upload"
+            st.rerun()
+    
+    with col2:
+        if st.button("🔍 Search Inbox", use_container_width=True):
+            st.session_state.current_page = "Ask My Inbox"
+            st.rerun()
+    
+    with col3:
+        if st.button("📈 View Analytics", use_container_width=True):
+            st.session_state.current_page = "Analytics"
+            st.rerun()
+
 if __name__ == "__main__":
     main()
 
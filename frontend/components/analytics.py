@@ -15,6 +15,9 @@ import numpy as np
 # API Configuration
 API_BASE_URL = "http://localhost:8000"
 
+# Line series longer than this are downsampled (LTTB) before plotting
+MAX_SERIES_POINTS = 2000
+
 def render_analytics():
     """Render analytics dashboard"""
     
@@ -218,6 +221,7 @@ def render_trend_analysis(emails: List[Dict[str, Any]]):
     
     # Daily activity
     daily_activity = email_df.groupby(['date_only', 'category']).size().reset_index(name='count')
+    daily_activity = downsample_series(daily_activity, 'date_only', 'count', 'category')
     
     # Create time series chart
     fig = px.line(
@@ -267,6 +271,49 @@ def render_trend_analysis(emails: List[Dict[str, Any]]):
         fig_days.update_layout(height=300)
         st.plotly_chart(fig_days, use_container_width=True)
 
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the series' visual shape
+    x must be numeric and sorted; the first and last points are always kept
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        
+        # Keep the point in this bucket forming the largest triangle with the last kept point
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected.append(a)
+    
+    selected.append(n - 1)
+    return np.array(selected)
+
+def downsample_series(df: pd.DataFrame, x: str, y: str, group: str, threshold: int = MAX_SERIES_POINTS) -> pd.DataFrame:
+    """Downsample each group's series to at most `threshold` points; short series pass through untouched"""
+    if df.groupby(group).size().max() <= threshold:
+        return df
+    
+    parts = []
+    for _, series in df.groupby(group, sort=False):
+        series = series.sort_values(x)
+        if len(series) > threshold:
+            x_values = pd.to_datetime(series[x]).to_numpy().astype('int64').astype(float)
+            series = series.iloc[lttb_indices(x_values, series[y].to_numpy(dtype=float), threshold)]
+        parts.append(series)
+    return pd.concat(parts, ignore_index=True)
+
 def render_category_analysis(emails: List[Dict[str, Any]]):
     """Render category analysis"""
     
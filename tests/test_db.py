@@ -0,0 +1,99 @@
+"""
+Test cases for database writes on the email processing path
+"""
+import pytest
+import tempfile
+import os
+import shutil
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+import sys
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from db import DatabaseManager, Email
+import main
+
+class TestStoreClassifications:
+    """Test how a processed batch is written to the database"""
+
+    def setup_method(self):
+        """Setup a database in a temporary directory"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_manager = DatabaseManager(db_path=os.path.join(self.temp_dir, "test.db"))
+        self.classification = {'category': 'Interview', 'summary': 'Interview invite', 'confidence': 0.9}
+
+    def teardown_method(self):
+        """Clean up temporary directory"""
+        self.db_manager.engine.dispose()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def make_email(self, gmail_id: str):
+        """A parsed email as the upload path hands it over, including non-column keys"""
+        return {
+            'gmail_id': gmail_id,
+            'account_email': 'me@example.com',
+            'subject': f'Subject {gmail_id}',
+            'sender': 'recruiter@example.com',
+            'recipient': 'me@example.com',
+            'snippet': 'We would like to schedule an interview',
+            'body': 'Full body',
+            'date_received': datetime(2024, 10, 15, 10, 30),
+            'labels': ['INBOX'],
+            'thread_id': 'thread-1'
+        }
+
+    def test_new_emails_use_bulk_insert(self):
+        """Test new rows go through add_emails_bulk and come back with their ids"""
+        classified = [(self.make_email(f'msg{i}'), None, self.classification) for i in range(3)]
+
+        with patch.object(main, 'db_manager', self.db_manager), \
+             patch.object(self.db_manager, 'add_emails_bulk', wraps=self.db_manager.add_emails_bulk) as mock_bulk:
+            items = main._store_classifications(classified)
+
+        mock_bulk.assert_called_once()
+        with self.db_manager.SessionLocal() as db:
+            stored = {email.gmail_id: email.id for email in db.query(Email).all()}
+        assert len(stored) == 3
+        assert sorted(item['metadata']['email_id'] for item in items) == sorted(stored.values())
+
+    def test_new_emails_refresh_planner_statistics(self):
+        """Test storing new rows runs ANALYZE, populating sqlite_stat1"""
+        classified = [(self.make_email(f'msg{i}'), None, self.classification) for i in range(3)]
+        
+        with patch.object(main, 'db_manager', self.db_manager):
+            main._store_classifications(classified)
+        
+        with self.db_manager.engine.connect() as conn:
+            indexes = {row[0] for row in conn.exec_driver_sql("SELECT idx FROM sqlite_stat1 WHERE tbl = 'emails'")}
+        assert 'ix_emails_category_date' in indexes
+
+    def test_conflicting_row_does_not_discard_chunk(self):
+        """Test a gmail_id stored concurrently is skipped while the rest of the chunk is kept"""
+        self.db_manager.add_email({'gmail_id': 'msg1', 'account_email': 'me@example.com'})
+        classified = [(self.make_email(f'msg{i}'), None, self.classification) for i in range(3)]
+        
+        with patch.object(main, 'db_manager', self.db_manager):
+            items = main._store_classifications(classified)
+        
+        assert sorted(item['embedding_id'] for item in items) == ['me@example.com_msg0', 'me@example.com_msg2']
+        with self.db_manager.SessionLocal() as db:
+            assert db.query(Email).filter(Email.is_processed == True).count() == 2
+
+    @pytest.mark.asyncio
+    async def test_batch_commits_every_chunk(self):
+        """Test each chunk is committed and embedded before the next is classified"""
+        emails = [self.make_email(f'msg{i}') for i in range(5)]
+        summarizer_chain = MagicMock()
+        summarizer_chain.classify_email = AsyncMock(side_effect=[self.classification] * 4 + [RuntimeError("LLM down")])
+        rag_pipeline = MagicMock()
+        rag_pipeline.add_emails = AsyncMock(return_value=True)
+        
+        with patch.object(main, 'db_manager', self.db_manager), patch.object(main, 'PROCESS_CHUNK_SIZE', 2):
+            await main.process_emails_batch(emails, summarizer_chain, rag_pipeline)
+        
+        assert rag_pipeline.add_emails.await_count == 2
+        with self.db_manager.SessionLocal() as db:
+            assert db.query(Email).count() == 4
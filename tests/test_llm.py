@@ -13,6 +13,22 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
 from llm_adapter import LLMAdapter
 
+def mock_stream(chunks):
+    """Build a stand-in for AsyncClient.stream that yields NDJSON generate chunks"""
+    response = MagicMock()
+    response.status_code = 200
+    
+    async def aiter_lines():
+        for chunk in chunks:
+            yield json.dumps({"response": chunk, "done": False})
+        yield json.dumps({"response": "", "done": True})
+    
+    response.aiter_lines = aiter_lines
+    context = MagicMock()
+    context.__aenter__ = AsyncMock(return_value=response)
+    context.__aexit__ = AsyncMock(return_value=False)
+    return MagicMock(return_value=context)
+
 class TestLLMAdapter:
     """Test LLM adapter functionality"""
     
@@ -85,6 +101,22 @@ class TestLLMAdapter:
         
         assert "no suitable models" in result
     
+    @patch('httpx.AsyncClient.get')
+    @pytest.mark.asyncio
+    async def test_health_check_caches_tags(self, mock_get):
+        """Test repeated health checks share one /api/tags fetch"""
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"models": [{"name": "mistral:7b"}]}
+        mock_get.return_value = mock_response
+        
+        results = await asyncio.gather(*[self.llm.health_check() for _ in range(5)])
+        models = await self.llm.list_models()
+        
+        assert all("healthy" in result for result in results)
+        assert models == ["mistral:7b"]
+        mock_get.assert_called_once()
+    
     @patch('httpx.AsyncClient.get')
     @pytest.mark.asyncio
     async def test_list_models(self, mock_get):
@@ -115,9 +147,9 @@ class TestLLMAdapter:
         # Mock successful API response
         mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_response.json.return_value = {
+        mock_response.aread = AsyncMock(return_value=json.dumps({
             "response": "This is a test response from the LLM."
-        }
+        }).encode())
         mock_post.return_value = mock_response
         
         prompt = "Classify this email as job-related or not."
@@ -128,10 +160,10 @@ class TestLLMAdapter:
         mock_post.assert_called_once()
         
         # Verify request structure
-        call_args = mock_post.call_args
-        assert call_args[1]['json']['model'] == "mistral:7b"
-        assert call_args[1]['json']['prompt'] == prompt
-        assert call_args[1]['json']['stream'] == False
+        request_body = json.loads(mock_post.call_args[1]['content'])
+        assert request_body['model'] == "mistral:7b"
+        assert request_body['prompt'] == prompt
+        assert request_body['stream'] == False
     
     @patch('httpx.AsyncClient.post')
     @pytest.mark.asyncio
@@ -139,9 +171,9 @@ class TestLLMAdapter:
         """Test response generation with system prompt"""
         mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_response.json.return_value = {
+        mock_response.aread = AsyncMock(return_value=json.dumps({
             "response": "Classified as job-related."
-        }
+        }).encode())
         mock_post.return_value = mock_response
         
         prompt = "Please classify this email."
@@ -153,7 +185,7 @@ class TestLLMAdapter:
         
         # Verify system prompt was included
         call_args = mock_post.call_args
-        assert call_args[1]['json']['system'] == system_prompt
+        assert json.loads(call_args[1]['content'])['system'] == system_prompt
     
     @patch('httpx.AsyncClient.post')
     @pytest.mark.asyncio
@@ -170,17 +202,14 @@ class TestLLMAdapter:
         assert "Error" in result
         assert "LLM request failed" in result
     
-    @patch('httpx.AsyncClient.post')
     @pytest.mark.asyncio
-    async def test_generate_structured_response(self, mock_post):
+    async def test_generate_structured_response(self):
         """Test structured JSON response generation"""
         # Mock successful structured response
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            "response": '{"category": "Application Sent", "confidence": 0.9, "summary": "Job application confirmation"}'
-        }
-        mock_post.return_value = mock_response
+        mock_client_stream = mock_stream([
+            '{"category": "Application Sent", ',
+            '"confidence": 0.9, "summary": "Job application confirmation"}'
+        ])
         
         prompt = "Classify this email"
         schema = {
@@ -189,7 +218,8 @@ class TestLLMAdapter:
             "summary": "string"
         }
         
-        result = await self.llm.generate_structured_response(prompt, schema)
+        with patch.object(self.llm.client, 'stream', mock_client_stream):
+            result = await self.llm.generate_structured_response(prompt, schema)
         
         assert isinstance(result, dict)
         assert "category" in result
@@ -197,27 +227,51 @@ class TestLLMAdapter:
         assert "summary" in result
         assert result["category"] == "Application Sent"
         assert result["confidence"] == 0.9
+        request_body = json.loads(mock_client_stream.call_args[1]['content'])
+        assert request_body['format'] == "json"
+        assert request_body['stream'] == True
+    
+    @pytest.mark.asyncio
+    async def test_generate_structured_response_stops_at_object_end(self):
+        """Test streaming stops once the JSON object closes"""
+        mock_client_stream = mock_stream([
+            '{"summary": "Uses {braces} and \\"quotes\\""}',
+            '\n\nHere is some trailing explanation {'
+        ])
+        
+        with patch.object(self.llm.client, 'stream', mock_client_stream):
+            result = await self.llm.generate_structured_response("Summarize", {"summary": "string"})
+        
+        assert result == {"summary": 'Uses {braces} and "quotes"'}
     
-    @patch('httpx.AsyncClient.post')
     @pytest.mark.asyncio
-    async def test_generate_structured_response_invalid_json(self, mock_post):
+    async def test_generate_structured_response_cached(self):
+        """Test identical structured prompts are answered from the cache"""
+        mock_client_stream = mock_stream(['{"category": "Rejection"}'])
+        
+        with patch.object(self.llm.client, 'stream', mock_client_stream):
+            first = await self.llm.generate_structured_response("Classify this email", {"category": "string"})
+            second = await self.llm.generate_structured_response("Classify this email", {"category": "string"})
+        
+        assert first == second == {"category": "Rejection"}
+        assert mock_client_stream.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_generate_structured_response_invalid_json(self):
         """Test structured response with invalid JSON"""
         # Mock response with invalid JSON
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            "response": "This is not valid JSON response"
-        }
-        mock_post.return_value = mock_response
+        mock_client_stream = mock_stream(["This is not valid JSON response"])
         
         prompt = "Classify this email"
         schema = {"category": "string"}
         
-        result = await self.llm.generate_structured_response(prompt, schema)
+        with patch.object(self.llm.client, 'stream', mock_client_stream):
+            result = await self.llm.generate_structured_response(prompt, schema)
         
         assert isinstance(result, dict)
         assert "error" in result
         assert result["parsed"] == False
+        assert mock_client_stream.call_count == 2  # One retry with the invalid reply
     
     @pytest.mark.asyncio
     async def test_classify_text(self):
@@ -364,6 +418,39 @@ class TestLLMAdapter:
             assert "Error" in results[1]  # Exception should be handled
             assert results[2] == "Success 3"
     
+    @pytest.mark.asyncio
+    async def test_batch_process_stream(self):
+        """Test streamed batch results arrive in completion order"""
+        delays = {"slow": 0.05, "fast": 0.0}
+        
+        async def fake_generate(prompt):
+            await asyncio.sleep(delays[prompt])
+            return f"done {prompt}"
+        
+        with patch.object(self.llm, 'generate_response', side_effect=fake_generate):
+            results = [item async for item in self.llm.batch_process_stream(["slow", "fast"])]
+        
+        assert results == [(1, "done fast"), (0, "done slow")]
+    
+    @pytest.mark.asyncio
+    async def test_batch_structured_response(self):
+        """Test batched structured responses keep order and send duplicate prompts once"""
+        async def fake_structured(prompt, schema, **kwargs):
+            if prompt == "bad":
+                raise Exception("API timeout")
+            return {"category": prompt}
+        
+        with patch.object(self.llm, 'generate_structured_response', side_effect=fake_structured) as mock_structured:
+            results = await self.llm.batch_structured_response(
+                ["Offer", "bad", "Offer", "Interview"], {"category": "string"}, max_concurrent=2
+            )
+        
+        assert results[0] == results[2] == {"category": "Offer"}
+        assert results[0] is not results[2]
+        assert results[1]["parsed"] is False
+        assert results[3] == {"category": "Interview"}
+        assert mock_structured.call_count == 3
+    
     @patch('httpx.AsyncClient.post')
     @pytest.mark.asyncio
     async def test_get_model_info(self, mock_post):
@@ -3,6 +3,7 @@ Test cases for email parser functionality
 """
 import pytest
 import json
+import base64
 from datetime import datetime
 import sys
 import os
@@ -78,6 +79,28 @@ Jane Smith
         
         assert len(emails) == 2
 
+    def test_extract_message_body_nested_parts(self):
+        """Test body extraction from nested multipart payloads keeps part order"""
+        encode = lambda text: base64.urlsafe_b64encode(text.encode()).decode()
+        payload = {
+            "mimeType": "multipart/mixed",
+            "parts": [
+                {"mimeType": "text/plain", "body": {"data": encode("first")}},
+                {
+                    "mimeType": "multipart/alternative",
+                    "parts": [
+                        {"mimeType": "text/plain", "body": {"data": encode("second")}},
+                        {"mimeType": "image/png", "body": {"data": encode("binary")}}
+                    ]
+                },
+                {"mimeType": "text/html", "body": {"data": encode("third")}}
+            ]
+        }
+        
+        body = self.parser._extract_message_body(payload)
+        
+        assert body == "first\nsecond\nthird"
+
     def test_parse_eml_content(self):
         """Test parsing EML content"""
         emails = self.parser.parse_eml_content(self.sample_eml_content, "test@gmail.com")
@@ -87,6 +110,14 @@ Jane Smith
         assert emails[0]['sender'] == "recruiter@company.com"
         assert "interview" in emails[0]['snippet'].lower()
 
+    def test_parse_eml_content_stable_fallback_id(self):
+        """Test EML files without Message-ID get the same ID on every parse"""
+        first = self.parser.parse_eml_content(self.sample_eml_content, "test@gmail.com")
+        second = self.parser.parse_eml_content(self.sample_eml_content, "test@gmail.com")
+        
+        assert first[0]['gmail_id'].startswith("eml_")
+        assert first[0]['gmail_id'] == second[0]['gmail_id']
+
     def test_validate_email_data(self):
         """Test email data validation"""
         valid_data = {
@@ -7,6 +7,10 @@ import tempfile
 import os
 import shutil
 import json
+import threading
+import time
+import numpy as np
+from unittest.mock import MagicMock, patch
 from datetime import datetime
 import sys
 
@@ -14,7 +18,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
 from rag_pipeline import RAGPipeline
-from utils import create_embedding_id
+from utils import LRUCache, create_embedding_id
 
 class TestRAGPipeline:
     """Test RAG pipeline functionality"""
@@ -74,15 +78,28 @@ class TestRAGPipeline:
         text = "This is a test email about job application"
         embedding = self.rag.generate_embedding(text)
         
-        assert isinstance(embedding, list)
+        assert isinstance(embedding, np.ndarray)
+        assert embedding.dtype == np.float32
         assert len(embedding) > 0
-        assert all(isinstance(x, float) for x in embedding)
+    
+    def test_query_embedding_cached(self):
+        """Test repeated queries are only encoded once"""
+        self.rag.embedding_cache = LRUCache(maxsize=1)
+        first = self.rag.generate_query_embedding("emails about Interview")
+        # Evict it from the document cache
+        self.rag.generate_embedding("something else entirely")
+        
+        with patch.object(self.rag.embedding_model, 'encode') as mock_encode:
+            second = self.rag.generate_query_embedding("emails about Interview")
+        
+        mock_encode.assert_not_called()
+        assert np.array_equal(first, second)
     
     def test_empty_text_embedding(self):
         """Test embedding generation for empty text"""
         embedding = self.rag.generate_embedding("")
         
-        assert isinstance(embedding, list)
+        assert isinstance(embedding, np.ndarray)
         assert len(embedding) > 0
         # Should return zero vector for empty text
         assert all(x == 0.0 for x in embedding)
@@ -101,6 +118,25 @@ class TestRAGPipeline:
         assert isinstance(embedding_id, str)
         assert email['metadata']['account'] in embedding_id
     
+    @pytest.mark.asyncio
+    async def test_add_emails_batch(self):
+        """Test adding several emails in one batch"""
+        items = [
+            {'content': email['content'], 'metadata': email['metadata'], 'embedding_id': f"batch_{i}"}
+            for i, email in enumerate(self.sample_emails)
+        ]
+        
+        ids = await self.rag.add_emails(items)
+        
+        assert ids == [f"batch_{i}" for i in range(len(self.sample_emails))]
+        assert self.rag.collection.count() == len(self.sample_emails)
+        
+        # Batch embeddings match the single-text path
+        assert np.array_equal(
+            self.rag.generate_embeddings([items[0]['content']])[0],
+            self.rag.generate_embedding(items[0]['content'])
+        )
+    
     @pytest.mark.asyncio 
     async def test_search_similar(self):
         """Test similarity search"""
@@ -125,6 +161,135 @@ class TestRAGPipeline:
             assert isinstance(result['similarity_score'], float)
             assert 0 <= result['similarity_score'] <= 1
 
+    @pytest.mark.asyncio
+    async def test_search_similar_results(self):
+        """Test columnar search results match the dict results"""
+        for email in self.sample_emails:
+            await self.rag.add_email(
+                content=email['content'],
+                metadata=email['metadata']
+            )
+        
+        results = await self.rag.search_similar_results("software engineer application", k=3)
+        
+        assert len(results) == 3
+        assert results.similarities.dtype == np.float32
+        assert np.allclose(results.similarities, 1 - results.distances)
+        assert list(results) == await self.rag.search_similar("software engineer application", k=3)
+
+    @pytest.mark.asyncio
+    async def test_search_similar_with_mmr(self):
+        """Test MMR skips near-duplicates of an already selected result"""
+        duplicate = self.sample_emails[0]
+        for i in range(3):
+            await self.rag.add_email(
+                content=duplicate['content'],
+                metadata={**duplicate['metadata'], 'email_id': 100 + i}
+            )
+        for email in self.sample_emails[1:]:
+            await self.rag.add_email(
+                content=email['content'],
+                metadata=email['metadata']
+            )
+        
+        plain = await self.rag.search_similar(duplicate['content'], k=2)
+        diverse = await self.rag.search_similar(duplicate['content'], k=2, mmr_lambda=0.5)
+        
+        assert plain[0]['content'] == plain[1]['content']
+        assert len(diverse) == 2
+        assert diverse[0]['content'] == duplicate['content']
+        assert diverse[1]['content'] != duplicate['content']
+
+    @pytest.mark.asyncio
+    async def test_search_similar_with_search_ef(self):
+        """Test a per-query search_ef leaves the collection setting unchanged"""
+        for email in self.sample_emails:
+            await self.rag.add_email(
+                content=email['content'],
+                metadata=email['metadata']
+            )
+        
+        default_ef = self.rag.collection.configuration["hnsw"]["ef_search"]
+        results = await self.rag.search_similar("interview", k=2, search_ef=400)
+        
+        assert len(results) == 2
+        assert self.rag.collection.configuration["hnsw"]["ef_search"] == default_ef
+
+    def test_default_query_waits_for_search_ef_override(self):
+        """Test a default query never runs at another query's temporary ef_search"""
+        default_ef = self.rag.collection.configuration["hnsw"]["ef_search"]
+        override_started = threading.Event()
+        seen_ef = {}
+        original_query = self.rag.collection.query
+        
+        def recording_query(**kwargs):
+            ef = self.rag.collection.configuration["hnsw"]["ef_search"]
+            seen_ef[kwargs['n_results']] = ef
+            if ef != default_ef:
+                override_started.set()
+                time.sleep(0.2)
+            return original_query(**kwargs)
+        
+        with patch.object(self.rag.collection, 'query', side_effect=recording_query):
+            override = threading.Thread(
+                target=self.rag._query,
+                kwargs={'search_ef': default_ef + 50, 'query_embeddings': [[0.1] * 384], 'n_results': 1}
+            )
+            override.start()
+            assert override_started.wait(timeout=5)
+            self.rag._query(query_embeddings=[[0.1] * 384], n_results=2)
+            override.join()
+        
+        assert seen_ef == {1: default_ef + 50, 2: default_ef}
+
+    @pytest.mark.asyncio
+    async def test_existing_l2_collection_similarity(self):
+        """Test a collection created with l2 space reports cosine similarity"""
+        self.rag.client.delete_collection(name="test_collection")
+        self.rag.client.create_collection(name="test_collection", metadata={"hnsw:space": "l2"})
+        rag = RAGPipeline(
+            collection_name="test_collection",
+            persist_directory=os.path.join(self.temp_dir, "embeddings")
+        )
+        assert rag._distance_space == "l2"
+
+        email = self.sample_emails[0]
+        await rag.add_email(content=email['content'], metadata=email['metadata'])
+        results = await rag.search_similar(email['content'], k=1)
+
+        assert len(results) == 1
+        assert results[0]['similarity_score'] == pytest.approx(1.0, abs=1e-3)
+        assert results[0]['similarity_score'] == pytest.approx(1 - results[0]['distance'] / 2)
+
+    def test_prepare_metadata_native_types(self):
+        """Test metadata keeps native scalars and gains epoch fields for datetimes"""
+        metadata = self.rag._prepare_metadata({
+            'email_id': np.int64(7),
+            'priority': 0.5,
+            'is_processed': True,
+            'category': 'Interview',
+            'date': '2024-10-15T10:30:00Z',
+            'followup': datetime(2024, 10, 20, 9, 0),
+            'summary': None
+        })
+        
+        assert metadata['email_id'] == 7 and type(metadata['email_id']) is int
+        assert metadata['priority'] == 0.5
+        assert metadata['is_processed'] is True
+        assert metadata['category'] == 'Interview'
+        assert metadata['date_epoch'] == 1728988200
+        assert metadata['followup'] == '2024-10-20T09:00:00'
+        assert metadata['followup_epoch'] == 1729414800
+        assert 'summary' not in metadata
+
+    def test_configure_hnsw_params(self):
+        """Test HNSW parameters grow with collection size"""
+        small = self.rag.configure_hnsw_params(100)
+        large = self.rag.configure_hnsw_params(1_000_000)
+        
+        assert small["hnsw:M"] < large["hnsw:M"]
+        assert small["hnsw:search_ef"] < large["hnsw:search_ef"]
+
     @pytest.mark.asyncio
     async def test_search_by_category(self):
         """Test search by category"""
@@ -164,12 +329,31 @@ class TestRAGPipeline:
         )
         
         assert isinstance(results, list)
+        assert len(results) == 2
         # Should find emails within the date range
         for result in results:
             date_str = result['metadata'].get('date', '')
             if date_str:
                 assert '2024-10-15' <= date_str[:10] <= '2024-10-16'
 
+    @pytest.mark.asyncio
+    async def test_search_by_timeframe_backfills_date_epoch(self):
+        """Rows stored before date_epoch existed are found once stats are rebuilt"""
+        email = self.sample_emails[0]
+        self.rag.collection.add(
+            ids=["legacy_email"],
+            embeddings=[[0.1] * 384],
+            documents=[email['content']],
+            metadatas=[{'category': email['metadata']['category'], 'date': email['metadata']['date']}]
+        )
+        assert await self.rag.search_by_timeframe(start_date="2024-10-15", end_date="2024-10-16") == []
+
+        self.rag.rebuild_stats()
+
+        results = await self.rag.search_by_timeframe(start_date="2024-10-15", end_date="2024-10-16")
+        assert len(results) == 1
+        assert results[0]['metadata']['date_epoch'] == 1728988200
+
     @pytest.mark.asyncio
     async def test_update_embedding(self):
         """Test updating an existing embedding"""
@@ -237,6 +421,48 @@ class TestRAGPipeline:
         assert isinstance(stats['categories'], dict)
         assert isinstance(stats['unique_accounts'], int)
 
+    @pytest.mark.asyncio
+    async def test_collection_stats_tracked(self):
+        """Test stats follow adds, updates and deletes and survive a restart"""
+        embedding_ids = []
+        for email in self.sample_emails:
+            embedding_ids.append(await self.rag.add_email(
+                content=email['content'],
+                metadata=email['metadata']
+            ))
+        
+        first_category = self.sample_emails[0]['metadata']['category']
+        expected = {}
+        for email in self.sample_emails:
+            category = email['metadata']['category']
+            expected[category] = expected.get(category, 0) + 1
+        assert self.rag.get_collection_stats()['categories'] == expected
+        
+        await self.rag.update_embedding(
+            embedding_ids[0],
+            self.sample_emails[0]['content'],
+            {**self.sample_emails[0]['metadata'], 'category': 'Offer'}
+        )
+        await self.rag.delete_embedding(embedding_ids[1])
+        expected[first_category] -= 1
+        expected[self.sample_emails[1]['metadata']['category']] -= 1
+        expected['Offer'] = expected.get('Offer', 0) + 1
+        expected = {category: count for category, count in expected.items() if count}
+        
+        stats = self.rag.get_collection_stats()
+        assert stats['categories'] == expected
+        assert stats['total_embeddings'] == len(self.sample_emails) - 1
+        
+        # A new pipeline on the same directory reads the sidecar
+        reopened = RAGPipeline(
+            collection_name="test_collection",
+            persist_directory=os.path.join(self.temp_dir, "embeddings")
+        )
+        with patch.object(reopened, 'rebuild_stats') as mock_rebuild:
+            reopened._load_stats()
+        mock_rebuild.assert_not_called()
+        assert reopened.get_collection_stats()['categories'] == expected
+
     @pytest.mark.asyncio
     async def test_semantic_search_with_reranking(self):
         """Test semantic search with reranking"""
@@ -263,6 +489,30 @@ class TestRAGPipeline:
                 assert 'rerank_score' in result
                 assert isinstance(result['rerank_score'], float)
 
+    @pytest.mark.asyncio
+    async def test_reranking_with_cross_encoder(self):
+        """Test the cross-encoder's scores decide the rerank order"""
+        for email in self.sample_emails:
+            await self.rag.add_email(
+                content=email['content'],
+                metadata=email['metadata']
+            )
+        
+        # Score the last candidate highest regardless of similarity
+        self.rag._reranker = MagicMock()
+        self.rag._reranker.predict.side_effect = lambda pairs, **kwargs: np.arange(len(pairs), dtype=np.float32)
+        
+        initial = await self.rag.search_similar("software engineer job application", k=3)
+        results = await self.rag.semantic_search_with_reranking(
+            query="software engineer job application",
+            k=3,
+            rerank_top_k=1
+        )
+        
+        assert len(results) == 1
+        assert results[0]['content'] == initial[-1]['content']
+        assert results[0]['rerank_score'] == 2.0
+
     @pytest.mark.asyncio
     async def test_get_similar_to_email(self):
         """Test finding emails similar to a specific email"""
@@ -282,7 +532,7 @@ class TestRAGPipeline:
         )
         
         assert isinstance(similar, list)
-        assert len(similar) <= 2
+        assert len(similar) == 2
         
         # Should not include the original email
         if similar:
@@ -300,19 +550,21 @@ class TestRAGPipeline:
             )
         
         # Export embeddings
-        export_path = os.path.join(self.temp_dir, "export.json")
+        export_path = os.path.join(self.temp_dir, "export.jsonl")
         success = await self.rag.export_embeddings(export_path)
         assert success == True
         assert os.path.exists(export_path)
         
-        # Verify export file structure
+        # Verify export file structure: a header line, then one line per row
         with open(export_path, 'r') as f:
-            export_data = json.load(f)
+            export_data = json.loads(f.readline())
+            rows = [json.loads(line) for line in f]
         
         assert 'collection_name' in export_data
         assert 'total_count' in export_data
-        assert 'data' in export_data
         assert export_data['total_count'] == len(self.sample_emails)
+        assert len(rows) == len(self.sample_emails)
+        assert {'id', 'doc', 'meta', 'emb'} <= set(rows[0])
         
         # Reset collection
         self.rag.reset_collection()
@@ -325,6 +577,28 @@ class TestRAGPipeline:
         results = await self.rag.search_similar("software engineer", k=5)
         assert len(results) > 0
 
+    @pytest.mark.asyncio
+    async def test_export_import_quantized_embeddings(self):
+        """Test int8 exports are smaller and restore usable embeddings"""
+        for email in self.sample_emails:
+            await self.rag.add_email(
+                content=email['content'],
+                metadata=email['metadata']
+            )
+        
+        full_path = os.path.join(self.temp_dir, "full.jsonl")
+        int8_path = os.path.join(self.temp_dir, "int8.jsonl")
+        assert await self.rag.export_embeddings(full_path)
+        assert await self.rag.export_embeddings(int8_path, embedding_dtype="int8")
+        assert os.path.getsize(int8_path) < os.path.getsize(full_path)
+        
+        self.rag.reset_collection()
+        assert await self.rag.import_embeddings(int8_path)
+        
+        results = await self.rag.search_similar(self.sample_emails[0]['content'], k=1)
+        assert results[0]['content'] == self.sample_emails[0]['content']
+        assert results[0]['similarity_score'] > 0.99
+
 class TestRAGPipelineIntegration:
     """Integration tests for RAG pipeline"""
     